@@ -0,0 +1,90 @@
+"""Before/after benchmark for the storyline get_graph_data query path.
+
+"before" runs the plugin's original get_graph_data (see legacy_graph_data),
+queries and Python rebuild both. "cold" is the current path right after the
+graph index and team cache were dropped, "warm" is the steady state.
+
+A cold request costs three round trips: the challenges joined to their
+storyline rows (which also seed the attribute snapshot), the team's solves
+(which also give the cache marker), and the expiry scheduler's scan of
+timed solves. That last one covers every team and only runs when the
+topology changes, so the per-team path stays at two queries; it cannot be
+folded into the team query without loading other teams' solves on every
+cache miss.
+
+Run from a CTFd checkout with these plugins installed:
+
+    python benchmarks/graph_data.py --challenges 1000 --iterations 50
+"""
+import argparse
+import contextlib
+import io
+
+from harness import (
+    QueryCounter,
+    create_benchmark_app,
+    measure,
+    seed_database,
+    storyline_module,
+)
+from legacy_graph_data import get_graph_data as legacy_get_graph_data
+
+from CTFd.models import db
+
+
+def legacy_graph_data(storyline, team_id):
+    # The original code printed debug output on every call.
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_get_graph_data(storyline.StorylineChallenge, team_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--challenges", type=int, default=1000)
+    parser.add_argument("--solves", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    storyline = storyline_module()
+
+    with app.app_context():
+        ids = seed_database(
+            challenges=args.challenges,
+            teams=1,
+            solves=args.solves,
+            dynamic=0,
+            flags=0,
+        )
+        team_id = ids["team_ids"][0]
+        counter = QueryCounter(db.engine)
+
+        def cold():
+            storyline.graph_index.invalidate_graph_index()
+            storyline.team_state_cache.clear()
+
+        results = {
+            "before": measure(
+                lambda: legacy_graph_data(storyline, team_id), args.iterations, counter
+            ),
+            "cold": measure(
+                lambda: storyline.get_graph_data(team_id),
+                args.iterations,
+                counter,
+                setup=cold,
+            ),
+            "warm": measure(
+                lambda: storyline.get_graph_data(team_id), args.iterations, counter
+            ),
+        }
+
+    print("challenges=%d solves=%d" % (args.challenges, args.solves))
+    for name, result in results.items():
+        print(
+            "%-6s p50=%8.2fms p99=%8.2fms queries=%.1f"
+            % (name, result["p50_ms"], result["p99_ms"], result["queries"])
+        )
+
+
+if __name__ == "__main__":
+    main()
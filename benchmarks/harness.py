@@ -0,0 +1,236 @@
+"""Shared seeding and timing helpers for the plugin benchmarks.
+
+The benchmarks need a CTFd checkout on the import path with these plugins
+installed under ``CTFd/plugins``. Each run creates a throwaway file-backed
+SQLite database.
+"""
+import importlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from CTFd import create_app
+from CTFd.config import TestingConfig
+from CTFd.models import Challenges, Flags, Solves, Teams, Users, db
+
+
+def create_benchmark_app(path=None):
+    path = path or os.path.join(tempfile.mkdtemp(), "benchmark.db")
+
+    class BenchmarkConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+
+    return create_app(BenchmarkConfig)
+
+
+def storyline_module():
+    return importlib.import_module("CTFd.plugins.storyline-graph")
+
+
+def seed_database(
+    challenges=1000,
+    chain_length=20,
+    fanout=100,
+    timed_ratio=0.1,
+    teams=100,
+    solves=20,
+    dynamic=50,
+    flags=20,
+    seed=0,
+):
+    """Seed challenges, a storyline DAG, teams, solves and flags.
+
+    The storyline is one root with ``fanout`` direct children followed by
+    chains of ``chain_length`` challenges; ``timed_ratio`` of the edges get
+    a 30 minute ``max_lifetime``. Returns the ids the benchmarks need.
+    """
+    from CTFd.plugins.dynamic_challenges import DynamicChallenge
+
+    rng = random.Random(seed)
+    storyline = storyline_module()
+
+    db.session.add_all(
+        Challenges(
+            name="challenge-%d" % i,
+            description="x" * 512,
+            connection_info="nc localhost %d" % (10000 + i),
+            category="category-%d" % (i % 8),
+            value=100,
+            state="visible",
+        )
+        for i in range(challenges)
+    )
+    db.session.add_all(
+        DynamicChallenge(
+            name="dynamic-%d" % i,
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=50,
+            function=rng.choice(["linear", "logarithmic"]),
+            state="visible",
+        )
+        for i in range(dynamic)
+    )
+    db.session.commit()
+
+    challenge_ids = [c for c, in db.session.query(Challenges.id).filter(Challenges.type == "standard")]
+    dynamic_ids = [c for c, in db.session.query(Challenges.id).filter(Challenges.type == "dynamic")]
+
+    root = challenge_ids[0]
+    edges = [(child, root) for child in challenge_ids[1 : fanout + 1]]
+    rest = challenge_ids[fanout + 1 :]
+    for start in range(0, len(rest), chain_length):
+        chain = rest[start : start + chain_length]
+        edges.append((chain[0], None))
+        edges.extend((child, parent) for parent, child in zip(chain, chain[1:]))
+    edges.append((root, None))
+
+    for challenge_id, predecessor_id in edges:
+        timed = predecessor_id is not None and rng.random() < timed_ratio
+        db.session.add(
+            storyline.StorylineChallenge(
+                challenge_id=challenge_id,
+                predecessor_id=predecessor_id,
+                max_lifetime=30 if timed else None,
+            )
+        )
+
+    static_challenge, regex_challenge = challenge_ids[-2], challenge_ids[-1]
+    for i in range(flags):
+        db.session.add(
+            Flags(challenge_id=static_challenge, type="static", content="flag{static_%d}" % i, data="")
+        )
+        db.session.add(
+            Flags(
+                challenge_id=regex_challenge,
+                type="regex",
+                content=r"flag\{regex_%d_[a-z0-9]{8}\}" % i,
+                data="case_insensitive" if i % 2 else "",
+            )
+        )
+    db.session.commit()
+
+    team_ids = []
+    for i in range(teams):
+        team = Teams(name="team-%d" % i, email="team-%d@examplectf.com" % i)
+        db.session.add(team)
+        db.session.flush()
+        user = Users(name="user-%d" % i, email="user-%d@examplectf.com" % i, team_id=team.id)
+        db.session.add(user)
+        db.session.flush()
+        team_ids.append(team.id)
+
+        now = datetime.utcnow()
+        solvable = challenge_ids + dynamic_ids
+        for challenge_id in rng.sample(solvable, min(solves, len(solvable))):
+            db.session.add(
+                Solves(
+                    user_id=user.id,
+                    team_id=team.id,
+                    challenge_id=challenge_id,
+                    ip="127.0.0.1",
+                    provided="flag",
+                    date=now - timedelta(minutes=rng.randint(0, 120)),
+                )
+            )
+    db.session.commit()
+
+    return {
+        "team_ids": team_ids,
+        "challenge_ids": challenge_ids,
+        "dynamic_ids": dynamic_ids,
+        "static_flag_challenge": static_challenge,
+        "regex_flag_challenge": regex_challenge,
+    }
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(fn, iterations, counter, setup=None):
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        db.session.remove()
+        start_count = counter.count
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count - start_count)
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(statistics.median(timings), 4),
+        "p99_ms": round(percentile(timings, 99), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+        "queries": round(statistics.fmean(queries), 2),
+    }
+
+
+@contextmanager
+def submission_request(app, submission):
+    with app.test_request_context(method="POST", json={"submission": submission}) as ctx:
+        yield ctx.request
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, params, results):
+    payload = {
+        "revision": git_revision(),
+        "created": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    return payload
+
+
+def compare_results(baseline, current):
+    lines = []
+    for name in sorted(current["results"]):
+        now = current["results"][name]
+        before = baseline["results"].get(name)
+        if before is None:
+            lines.append("%-40s %10.3fms  (new)" % (name, now["p50_ms"]))
+            continue
+        ratio = now["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")
+        lines.append(
+            "%-40s %10.3fms -> %10.3fms  x%.2f  queries %s -> %s"
+            % (name, before["p50_ms"], now["p50_ms"], ratio, before["queries"], now["queries"])
+        )
+    return "\n".join(lines)
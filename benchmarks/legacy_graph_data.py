@@ -0,0 +1,150 @@
+"""The storyline graph path as it was before the graph index and team cache.
+
+Copied from the plugin's original get_unlocked_challenges_for_team and
+get_graph_data so the benchmark's "before" case runs the old Python
+rebuild, not only its queries. StorylineChallenge is passed in because the
+plugin package name is not importable directly.
+"""
+from datetime import datetime, timedelta
+
+from CTFd.models import Challenges, Solves, db
+
+
+def get_unlocked_challenges_for_team(StorylineChallenge, team_id):
+    if not team_id:
+        return []
+
+    solved_challenges = db.session.query(Solves.challenge_id, Solves.date).filter_by(team_id=team_id).all()
+    solved_ids = [solve.challenge_id for solve in solved_challenges]
+    solved_dict = {solve.challenge_id: solve.date for solve in solved_challenges}
+
+    storyline_challenges = StorylineChallenge.query.all()
+    storyline_dict = {sc.challenge_id: sc for sc in storyline_challenges}
+
+    unlocked_ids = set()
+
+    for challenge in Challenges.query.all():
+        if challenge.id in storyline_dict:
+            sc = storyline_dict[challenge.id]
+
+            if not sc.predecessor_id:
+                unlocked_ids.add(challenge.id)
+            elif sc.predecessor_id in solved_ids:
+                predecessor_solve_time = solved_dict[sc.predecessor_id]
+
+                if sc.max_lifetime:
+                    time_limit = timedelta(minutes=sc.max_lifetime)
+                    if datetime.utcnow() - predecessor_solve_time <= time_limit:
+                        unlocked_ids.add(challenge.id)
+                else:
+                    unlocked_ids.add(challenge.id)
+        else:
+            unlocked_ids.add(challenge.id)
+
+    return list(unlocked_ids)
+
+def get_graph_data(StorylineChallenge, team_id=None):
+    challenges = Challenges.query.all()
+    storyline_challenges = StorylineChallenge.query.all()
+
+    storyline_dict = {sc.challenge_id: sc for sc in storyline_challenges}
+    challenge_dict = {c.id: c for c in challenges}
+
+    nodes = []
+    edges = []
+
+    solved_ids = set()
+    unlocked_ids = set()
+    
+    if team_id:
+        solved_challenges = Solves.query.filter_by(team_id=team_id).all()
+        solved_ids = {solve.challenge_id for solve in solved_challenges}
+        unlocked_ids = set(get_unlocked_challenges_for_team(StorylineChallenge, team_id))
+    else:
+        unlocked_ids = {c.id for c in challenges}
+
+    visible_challenge_ids = set()
+    if team_id:
+        visible_challenge_ids = solved_ids.copy()
+        
+        for challenge_id in unlocked_ids:
+            if challenge_id in storyline_dict:
+                sc = storyline_dict[challenge_id]
+                if (sc.predecessor_id is None or 
+                    sc.predecessor_id in solved_ids or 
+                    sc.predecessor_id in unlocked_ids):
+                    visible_challenge_ids.add(challenge_id)
+            else:
+                visible_challenge_ids.add(challenge_id)
+    else:
+        visible_challenge_ids = {c.id for c in challenges}
+
+    added_node_ids = set()
+    
+    for challenge in challenges:
+        if challenge.id not in visible_challenge_ids:
+            continue
+            
+
+        if challenge.id in added_node_ids:
+            continue
+            
+        status = 'locked'
+        if team_id:
+            if challenge.id in solved_ids:
+                status = 'solved'
+            elif challenge.id in unlocked_ids:
+                status = 'unlocked'
+        else:
+            status = 'unlocked'
+
+        node = {
+            'id': challenge.id,
+            'label': challenge.name,
+            'status': status,
+            'category': challenge.category,
+            'value': challenge.value
+        }
+
+        if challenge.id in storyline_dict:
+            sc = storyline_dict[challenge.id]
+            if sc.max_lifetime:
+                node['max_lifetime'] = sc.max_lifetime
+
+        nodes.append(node)
+        added_node_ids.add(challenge.id)
+
+
+    added_edges = set()
+    
+    for sc in storyline_challenges:
+        if (sc.predecessor_id and 
+            sc.predecessor_id in visible_challenge_ids and 
+            sc.challenge_id in visible_challenge_ids):
+            
+            edge_key = (sc.predecessor_id, sc.challenge_id)
+            
+            if edge_key in added_edges:
+                continue
+                
+            edges.append({
+                'from': sc.predecessor_id,
+                'to': sc.challenge_id,
+                'has_timer': sc.max_lifetime is not None
+            })
+            added_edges.add(edge_key)
+
+
+    if team_id:
+        print(f" * Debug for team {team_id}:")
+        print(f"   - Total challenges: {len(challenges)}")
+        print(f"   - Solved challenges: {len(solved_ids)} - {list(solved_ids)}")
+        print(f"   - Unlocked challenges: {len(unlocked_ids)} - {list(unlocked_ids)}")
+        print(f"   - Visible challenges: {len(visible_challenge_ids)} - {list(visible_challenge_ids)}")
+        print(f"   - Storyline challenges: {len(storyline_challenges)}")
+        for sc in storyline_challenges:
+            challenge_name = challenge_dict.get(sc.challenge_id, {}).name if sc.challenge_id in challenge_dict else f"ID:{sc.challenge_id}"
+            predecessor_name = challenge_dict.get(sc.predecessor_id, {}).name if sc.predecessor_id and sc.predecessor_id in challenge_dict else f"ID:{sc.predecessor_id}"
+            print(f"     {challenge_name} <- {predecessor_name if sc.predecessor_id else 'ROOT'}")
+
+    return {'nodes': nodes, 'edges': edges}
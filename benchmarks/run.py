@@ -0,0 +1,172 @@
+"""Benchmark suite for the storyline, flag and dynamic scoring hot paths.
+
+Seeds a throwaway SQLite database with a configurable storyline (one wide
+fan-out plus fixed-length chains, some edges timed), teams with solves,
+static and regex flags and dynamic challenges, then times each hot path
+and counts the SQL statements it issues. Results are printed and can be
+written as JSON and compared against an earlier run:
+
+    python benchmarks/run.py --output before.json
+    ... apply a change ...
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import random
+
+from harness import (
+    QueryCounter,
+    compare_results,
+    create_benchmark_app,
+    measure,
+    seed_database,
+    storyline_module,
+    submission_request,
+    write_results,
+)
+
+from CTFd.models import Challenges, db
+
+
+def storyline_benchmarks(ids, iterations, counter, rng):
+    storyline = storyline_module()
+    graph_index = storyline.graph_index
+    team_ids = ids["team_ids"]
+
+    def cold():
+        graph_index.invalidate_graph_index()
+        storyline.team_state_cache.clear()
+
+    return {
+        "storyline.unlocked.cold": measure(
+            lambda: storyline.get_unlocked_challenges_for_team(rng.choice(team_ids)),
+            iterations,
+            counter,
+            setup=cold,
+        ),
+        "storyline.unlocked.warm": measure(
+            lambda: storyline.get_unlocked_challenges_for_team(team_ids[0]),
+            iterations,
+            counter,
+        ),
+        "storyline.graph_data.cold": measure(
+            lambda: storyline.get_graph_data(rng.choice(team_ids)),
+            iterations,
+            counter,
+            setup=cold,
+        ),
+        "storyline.graph_data.warm": measure(
+            lambda: storyline.get_graph_data(team_ids[0]), iterations, counter
+        ),
+    }
+
+
+def attempt_benchmarks(app, ids, flags, iterations, counter):
+    from CTFd.plugins.challenges import BaseChallenge
+
+    cases = {
+        "attempt.static.first": (ids["static_flag_challenge"], "flag{static_0}"),
+        "attempt.static.last": (
+            ids["static_flag_challenge"],
+            "flag{static_%d}" % (flags - 1),
+        ),
+        "attempt.static.wrong": (ids["static_flag_challenge"], "flag{wrong}"),
+        "attempt.regex.last": (
+            ids["regex_flag_challenge"],
+            "FLAG{REGEX_%d_ABCD1234}" % (flags - 1)
+            if (flags - 1) % 2
+            else "flag{regex_%d_abcd1234}" % (flags - 1),
+        ),
+        "attempt.regex.wrong": (ids["regex_flag_challenge"], "flag{regex_x_abcd1234}"),
+    }
+
+    results = {}
+    for name, (challenge_id, submission) in cases.items():
+        challenge = Challenges.query.filter_by(id=challenge_id).first()
+        with submission_request(app, submission) as request:
+
+            def attempt():
+                return BaseChallenge.attempt(challenge, request)
+
+            status, _ = attempt()
+            assert status == (not name.endswith(".wrong")), name
+            results[name] = measure(attempt, iterations, counter)
+    return results
+
+
+def dynamic_benchmarks(ids, iterations, counter, rng):
+    from CTFd.plugins.dynamic_challenges import DynamicChallenge, DynamicValueChallenge
+
+    def calculate():
+        challenge = DynamicChallenge.query.filter_by(
+            id=rng.choice(ids["dynamic_ids"])
+        ).first()
+        DynamicValueChallenge.calculate_value(challenge)
+
+    return {"dynamic.calculate_value": measure(calculate, iterations, counter)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--challenges", type=int, default=1000)
+    parser.add_argument("--chain-length", type=int, default=20)
+    parser.add_argument("--fanout", type=int, default=100)
+    parser.add_argument("--timed-ratio", type=float, default=0.1)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--solves", type=int, default=20, help="solves per team")
+    parser.add_argument("--dynamic", type=int, default=50)
+    parser.add_argument("--flags", type=int, default=20, help="flags per type")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    params = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("output", "compare")
+    }
+    app = create_benchmark_app()
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        ids = seed_database(
+            challenges=args.challenges,
+            chain_length=args.chain_length,
+            fanout=args.fanout,
+            timed_ratio=args.timed_ratio,
+            teams=args.teams,
+            solves=args.solves,
+            dynamic=args.dynamic,
+            flags=args.flags,
+            seed=args.seed,
+        )
+        counter = QueryCounter(db.engine)
+
+        results = {}
+        results.update(storyline_benchmarks(ids, args.iterations, counter, rng))
+        results.update(
+            attempt_benchmarks(app, ids, args.flags, args.iterations, counter)
+        )
+        results.update(dynamic_benchmarks(ids, args.iterations, counter, rng))
+
+    for name in sorted(results):
+        result = results[name]
+        print(
+            "%-28s p50=%9.3fms p99=%9.3fms queries=%.1f"
+            % (name, result["p50_ms"], result["p99_ms"], result["queries"])
+        )
+
+    payload = {"params": params, "results": results}
+    if args.output:
+        payload = write_results(args.output, params, results)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print(compare_results(baseline, payload))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,18 @@
-from flask import Blueprint
+import atexit
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from uuid import uuid4
 
+from flask import Blueprint, abort, jsonify, request
+from sqlalchemy import inspect
+from sqlalchemy.exc import DataError, IntegrityError
+
+from CTFd.cache import cache
 from CTFd.models import (
     ChallengeFiles,
     Challenges,
@@ -11,9 +24,620 @@ from CTFd.models import (
     db,
 )
 from CTFd.plugins import register_plugin_assets_directory
-from CTFd.plugins.flags import FlagException, get_flag_class
-from CTFd.utils.uploads import delete_file
-from CTFd.utils.user import get_ip
+from CTFd.plugins.flags import (
+    FlagException,
+    flag_digest,
+    flag_matchers,
+    get_flag_class,
+    get_matchers_version,
+)
+from CTFd.utils.decorators import admins_only
+from CTFd.utils.uploads import get_uploader
+from CTFd.utils.user import get_current_user_attrs, get_ip
+
+log = logging.getLogger(__name__)
+
+CHALLENGE_DEFINITIONS_VERSION_KEY = "challenge_definitions_version"
+
+BULK_DELETE_CHUNK_SIZE = 500
+
+
+class FailBuffer(object):
+    def __init__(self, size=0, interval=1.0, max_depth=100000):
+        self.size = size
+        self.interval = interval
+        self.max_depth = max_depth
+        self.app = None
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._records = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.size > 0
+
+    @property
+    def depth(self):
+        return len(self._records)
+
+    def start(self, app):
+        self.app = app
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="fail-buffer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            self._trim()
+            full = len(self._records) >= self.size
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            if not records:
+                return 0
+
+            records.sort(key=lambda record: record["date"])
+            start = time.perf_counter()
+            inserted = 0
+            rejected = 0
+            # One bad row (say a fail from an account deleted since it was
+            # buffered) rejects the whole statement. Split a rejected batch
+            # until the offending rows are isolated and drop those, so they
+            # cannot block every later flush. ``batches`` is a stack with the
+            # oldest records on top.
+            batches = [records]
+            try:
+                with self.app.app_context():
+                    while batches:
+                        batch = batches[-1]
+                        try:
+                            with db.engine.begin() as connection:
+                                connection.execute(Fails.__table__.insert(), batch)
+                        except (IntegrityError, DataError) as e:
+                            batches.pop()
+                            if len(batch) > 1:
+                                middle = len(batch) // 2
+                                batches.extend([batch[middle:], batch[:middle]])
+                            else:
+                                log.warning(
+                                    "Dropped fail of user %s on challenge %s: %s",
+                                    batch[0]["user_id"],
+                                    batch[0]["challenge_id"],
+                                    e.orig,
+                                )
+                                rejected += 1
+                            continue
+                        batches.pop()
+                        inserted += len(batch)
+            except Exception:
+                # Anything else means the database is unreachable: keep what
+                # was not written for the next flush.
+                remaining = [record for batch in reversed(batches) for record in batch]
+                log.exception("Failed to flush %d buffered fails", len(remaining))
+                with self._lock:
+                    self.errors += 1
+                    self.flushed += inserted
+                    self.rejected += rejected
+                    self._records[:0] = remaining
+                    self._trim()
+                return inserted
+
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.flushes += 1
+                self.flushed += inserted
+                self.rejected += rejected
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            return inserted
+
+    def _trim(self):
+        # While the database is unreachable the oldest fails are dropped
+        # rather than letting the queue grow without bound.
+        excess = len(self._records) - self.max_depth
+        if excess > 0:
+            del self._records[:excess]
+            self.dropped += excess
+
+    def discard(self, challenge_ids=(), user_ids=(), team_ids=()):
+        # Buffered rows pointing at deleted challenges or accounts would be
+        # rejected by their foreign keys, so drop them up front.
+        challenge_ids = set(challenge_ids)
+        user_ids = set(user_ids)
+        team_ids = set(team_ids)
+        with self._lock:
+            self._records = [
+                record
+                for record in self._records
+                if record["challenge_id"] not in challenge_ids
+                and record["user_id"] not in user_ids
+                and record["team_id"] not in team_ids
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": len(self._records),
+                "max_depth": self.max_depth,
+                "flushes": self.flushes,
+                "flushed": self.flushed,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "last_flush_seconds": self.last_flush_seconds,
+                "max_flush_seconds": self.max_flush_seconds,
+            }
+
+
+fail_buffer = FailBuffer()
+
+
+class FileCleaner(object):
+    def __init__(self, retries=3, retry_delay=1.0, max_jobs=256):
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_jobs = max_jobs
+        self.app = None
+        self.deleted = 0
+        self.failed = 0
+        self.retried = 0
+        self._tasks = []
+        self._jobs = OrderedDict()
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    def start(self, app):
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="file-cleaner", daemon=True
+            )
+            self._thread.start()
+
+    def enqueue(self, locations, now=None):
+        job_id = uuid4().hex
+        now = time.monotonic() if now is None else now
+        with self._condition:
+            self._jobs[job_id] = {
+                "total": len(locations),
+                "deleted": 0,
+                "failed": 0,
+                "retries": 0,
+            }
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+            for location in locations:
+                self._push(now, job_id, location, 0)
+            self._condition.notify()
+        return job_id
+
+    def _push(self, due, job_id, location, attempt):
+        # The sequence keeps tasks due at the same time in insertion order.
+        self._sequence += 1
+        heapq.heappush(self._tasks, (due, self._sequence, job_id, location, attempt))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    if self._tasks and self._tasks[0][0] <= now:
+                        break
+                    self._condition.wait(
+                        self._tasks[0][0] - now if self._tasks else None
+                    )
+            self.run_pending()
+
+    def run_pending(self, now=None):
+        now = time.monotonic() if now is None else now
+        processed = 0
+        while True:
+            with self._condition:
+                if not self._tasks or self._tasks[0][0] > now:
+                    return processed
+                _, _, job_id, location, attempt = heapq.heappop(self._tasks)
+            self._remove(job_id, location, attempt, now)
+            processed += 1
+
+    def _remove(self, job_id, location, attempt, now):
+        try:
+            with self.app.app_context():
+                get_uploader().delete(filename=location)
+        except Exception:
+            with self._condition:
+                job = self._jobs.get(job_id)
+                if attempt < self.retries:
+                    self.retried += 1
+                    if job is not None:
+                        job["retries"] += 1
+                    due = now + self.retry_delay * 2 ** attempt
+                    self._push(due, job_id, location, attempt + 1)
+                    self._condition.notify()
+                    return
+                self.failed += 1
+                if job is not None:
+                    job["failed"] += 1
+            log.exception("Failed to delete challenge file %s", location)
+            return
+
+        with self._condition:
+            self.deleted += 1
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["deleted"] += 1
+
+    def progress(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            progress = dict(job)
+        progress["pending"] = (
+            progress["total"] - progress["deleted"] - progress["failed"]
+        )
+        return progress
+
+    def stats(self):
+        with self._condition:
+            return {
+                "pending": len(self._tasks),
+                "deleted": self.deleted,
+                "failed": self.failed,
+                "retries": self.retried,
+                "jobs": len(self._jobs),
+            }
+
+
+file_cleaner = FileCleaner()
+
+
+class SubmissionThrottle(object):
+    def __init__(self, rate=0, burst=10, maxsize=65536):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.throttled = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def allow(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens, last = bucket
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.throttled += 1
+            # Evicted buckets are the least recently used ones, which would
+            # most likely have refilled by now anyway.
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class WrongSubmissionCache(object):
+    def __init__(self, ttl=0, maxsize=65536):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key, version, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, entry_version, result = entry
+            if expires_at <= now or entry_version != version:
+                del self._entries[key]
+                return None
+            self.hits += 1
+            return result
+
+    def put(self, key, version, result, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, version, result)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class KeyedLock(object):
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class DefinitionCache(object):
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._definitions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        version = get_definitions_version()
+        with self._lock:
+            if version != self.version:
+                self._definitions.clear()
+                self.version = version
+            data = self._definitions.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self._definitions.move_to_end(key)
+                self.hits += 1
+            return data, version
+
+    def put(self, key, version, data):
+        with self._lock:
+            if self.version != version:
+                return
+            self._definitions[key] = data
+            while len(self._definitions) > self.maxsize:
+                self._definitions.popitem(last=False)
+
+    def invalidate(self):
+        # The version lives in the shared cache so every worker drops its
+        # definitions, not just the one that handled the write.
+        cache.set(CHALLENGE_DEFINITIONS_VERSION_KEY, uuid4().hex, timeout=0)
+        with self._lock:
+            self._definitions.clear()
+            self.version = None
+
+    def __len__(self):
+        return len(self._definitions)
+
+
+def get_definitions_version():
+    version = cache.get(CHALLENGE_DEFINITIONS_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.set(CHALLENGE_DEFINITIONS_VERSION_KEY, version, timeout=0)
+    return version
+
+
+challenge_definitions = DefinitionCache()
+submission_throttle = SubmissionThrottle()
+wrong_submissions = WrongSubmissionCache()
+solve_locks = KeyedLock()
+
+
+def get_submission_account():
+    user = get_current_user_attrs()
+    if user is None:
+        return None
+    if user.team_id:
+        return "team", user.team_id
+    return "user", user.id
+
+
+SOLVE_HOOKS = []
+SOLVED_HOOKS = []
+
+
+def register_solve_hook(hook, after_commit=False):
+    # Hooks are called with the SubmissionPipeline. Regular hooks run inside
+    # the solve's transaction; after_commit hooks run once it is committed
+    # and cannot undo it.
+    hooks = SOLVED_HOOKS if after_commit else SOLVE_HOOKS
+    if hook not in hooks:
+        hooks.append(hook)
+
+
+class SubmissionPipeline(object):
+    def __init__(self, challenge_class, challenge, request):
+        data = request.form or request.get_json()
+        self.challenge_class = challenge_class
+        self.challenge = challenge
+        self.request = request
+        self.provided = data["submission"].strip()
+        self.ip = get_ip(req=request)
+        self.user = None
+        self.team = None
+        self.solve = None
+        self.throttled = False
+
+    @classmethod
+    def for_request(cls, challenge_class, challenge, request):
+        # CTFd calls attempt() and then solve() or fail() for the same
+        # request, so they share one pipeline and parse the body once. It is
+        # kept on the request because g outlives it inside an app context.
+        pipelines = getattr(request, "submission_pipelines", None)
+        if pipelines is None:
+            pipelines = request.submission_pipelines = {}
+        pipeline = pipelines.get(challenge.id)
+        if pipeline is None:
+            pipeline = cls(challenge_class, challenge, request)
+            pipelines[challenge.id] = pipeline
+        return pipeline
+
+    def attempt(self):
+        challenge = self.challenge
+        account = get_submission_account()
+        if account is not None and submission_throttle.enabled:
+            if not submission_throttle.allow((account, challenge.id)):
+                self.throttled = True
+                return False, "You're submitting flags too fast. Slow down."
+
+        check_flags = self.challenge_class.check_flags
+        if account is None or not wrong_submissions.enabled:
+            return check_flags(challenge, self.provided)
+
+        # Keyed on the flag matcher version so that editing a challenge's
+        # flags drops every cached answer for it.
+        key = (account, challenge.id, flag_digest(self.provided))
+        version = get_matchers_version()
+        result = wrong_submissions.get(key, version)
+        if result is None:
+            result = check_flags(challenge, self.provided)
+            if not result[0]:
+                wrong_submissions.put(key, version, result)
+        return result
+
+    def find_solve(self, user, team):
+        query = Solves.query.filter_by(challenge_id=self.challenge.id)
+        if team is not None:
+            return query.filter_by(team_id=team.id).first()
+        return query.filter_by(user_id=user.id).first()
+
+    def record_solve(self, user, team):
+        self.user = user
+        self.team = team
+        account = ("team", team.id) if team is not None else ("user", user.id)
+        # Concurrent correct submissions from one account are serialized
+        # here; the unique constraints on Solves catch those that race in
+        # from other processes. Either way the first solve is returned.
+        with solve_locks.hold(account + (self.challenge.id,)):
+            existing = self.find_solve(user, team)
+            if existing is not None:
+                self.solve = existing
+                return existing
+
+            self.solve = Solves(
+                user_id=user.id,
+                team_id=team.id if team else None,
+                challenge_id=self.challenge.id,
+                ip=self.ip,
+                provided=self.provided,
+            )
+            try:
+                db.session.add(self.solve)
+                self.challenge_class.apply_solve(
+                    user, team, self.challenge, self.solve
+                )
+                for hook in SOLVE_HOOKS:
+                    hook(self)
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                existing = self.find_solve(user, team)
+                if existing is None:
+                    raise
+                self.solve = existing
+                return existing
+            except Exception:
+                db.session.rollback()
+                raise
+
+        for hook in SOLVED_HOOKS:
+            try:
+                hook(self)
+            except Exception:
+                log.exception("Solve hook %r failed", hook)
+        return self.solve
+
+    def record_fail(self, user, team):
+        if self.throttled:
+            return
+        self.user = user
+        self.team = team
+        challenge = self.challenge
+        # Attempt limits are enforced by counting Fails, so those challenges
+        # keep writing synchronously.
+        if fail_buffer.enabled and not challenge.max_attempts:
+            fail_buffer.add(
+                {
+                    "user_id": user.id,
+                    "team_id": team.id if team else None,
+                    "challenge_id": challenge.id,
+                    "ip": self.ip,
+                    "provided": self.provided,
+                    "type": "incorrect",
+                    "date": datetime.utcnow(),
+                }
+            )
+            return
+        wrong = Fails(
+            user_id=user.id,
+            team_id=team.id if team else None,
+            challenge_id=challenge.id,
+            ip=self.ip,
+            provided=self.provided,
+        )
+        db.session.add(wrong)
+        db.session.commit()
 
 
 class BaseChallenge(object):
@@ -36,6 +660,19 @@ class BaseChallenge(object):
 
     @classmethod
     def read(cls, challenge):
+        # The value changes on every dynamic solve, so it is read from the
+        # challenge each time instead of invalidating the cached definition.
+        key = (cls.id, challenge.id)
+        data, version = challenge_definitions.get(key)
+        if data is None:
+            data = cls.serialize(challenge)
+            challenge_definitions.put(key, version, data)
+        data = dict(data)
+        data["value"] = challenge.value
+        return data
+
+    @classmethod
+    def serialize(cls, challenge):
         data = {
             "id": challenge.id,
             "name": challenge.name,
@@ -64,27 +701,80 @@ class BaseChallenge(object):
             setattr(challenge, attr, value)
 
         db.session.commit()
+        challenge_definitions.invalidate()
         return challenge
 
     @classmethod
     def delete(cls, challenge):
-        Fails.query.filter_by(challenge_id=challenge.id).delete()
-        Solves.query.filter_by(challenge_id=challenge.id).delete()
-        Flags.query.filter_by(challenge_id=challenge.id).delete()
-        files = ChallengeFiles.query.filter_by(challenge_id=challenge.id).all()
-        for f in files:
-            delete_file(f.id)
-        ChallengeFiles.query.filter_by(challenge_id=challenge.id).delete()
-        Tags.query.filter_by(challenge_id=challenge.id).delete()
-        Hints.query.filter_by(challenge_id=challenge.id).delete()
-        Challenges.query.filter_by(id=challenge.id).delete()
-        cls.challenge_model.query.filter_by(id=challenge.id).delete()
-        db.session.commit()
+        cls.bulk_delete([challenge])
+
+    @classmethod
+    def bulk_delete(cls, challenges):
+        # Everything is removed with set-based DELETEs in one transaction;
+        # the uploaded files are only queued for removal once it commits.
+        challenge_ids = sorted({challenge.id for challenge in challenges})
+        if not challenge_ids:
+            return None
+
+        files = ChallengeFiles.__table__
+        # Challenge type tables reference their parent's table, so they are
+        # deleted deepest first and the challenges table last.
+        tables = dict.fromkeys(
+            mapper.local_table for mapper in inspect(Challenges).self_and_descendants
+        )
+        challenge_tables = list(reversed(list(tables)))
+
+        locations = []
+        try:
+            for start in range(0, len(challenge_ids), BULK_DELETE_CHUNK_SIZE):
+                ids = challenge_ids[start : start + BULK_DELETE_CHUNK_SIZE]
+                rows = db.session.query(ChallengeFiles.location).filter(
+                    ChallengeFiles.challenge_id.in_(ids)
+                )
+                locations.extend(location for location, in rows)
+                # Solves before Fails: the solves table references the
+                # submissions rows that Fails.__table__ deletes.
+                for table in (
+                    Solves.__table__,
+                    Fails.__table__,
+                    Flags.__table__,
+                    Tags.__table__,
+                    Hints.__table__,
+                ):
+                    db.session.execute(
+                        table.delete().where(table.c.challenge_id.in_(ids))
+                    )
+                db.session.execute(
+                    files.delete().where(
+                        files.c.challenge_id.in_(ids), files.c.type == "challenge"
+                    )
+                )
+                for table in challenge_tables:
+                    db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        for challenge in challenges:
+            if challenge in db.session:
+                db.session.expunge(challenge)
+        fail_buffer.discard(challenge_ids)
+        flag_matchers.invalidate()
+        challenge_definitions.invalidate()
+        if not locations:
+            return None
+        return file_cleaner.enqueue(locations)
 
     @classmethod
     def attempt(cls, challenge, request):
-        data = request.form or request.get_json()
-        submission = data["submission"].strip()
+        return SubmissionPipeline.for_request(cls, challenge, request).attempt()
+
+    @classmethod
+    def check_flags(cls, challenge, submission):
+        result = flag_matchers.get(challenge.id).match(submission)
+        if result is not None:
+            return result
         flags = Flags.query.filter_by(challenge_id=challenge.id).all()
         for flag in flags:
             try:
@@ -96,31 +786,20 @@ class BaseChallenge(object):
 
     @classmethod
     def solve(cls, user, team, challenge, request):
-        data = request.form or request.get_json()
-        submission = data["submission"].strip()
-        solve = Solves(
-            user_id=user.id,
-            team_id=team.id if team else None,
-            challenge_id=challenge.id,
-            ip=get_ip(req=request),
-            provided=submission,
+        return SubmissionPipeline.for_request(cls, challenge, request).record_solve(
+            user, team
         )
-        db.session.add(solve)
-        db.session.commit()
+
+    @classmethod
+    def apply_solve(cls, user, team, challenge, solve):
+        # Runs inside the solve's transaction, before it is committed.
+        pass
 
     @classmethod
     def fail(cls, user, team, challenge, request):
-        data = request.form or request.get_json()
-        submission = data["submission"].strip()
-        wrong = Fails(
-            user_id=user.id,
-            team_id=team.id if team else None,
-            challenge_id=challenge.id,
-            ip=get_ip(request),
-            provided=submission,
+        SubmissionPipeline.for_request(cls, challenge, request).record_fail(
+            user, team
         )
-        db.session.add(wrong)
-        db.session.commit()
 
 
 class CTFdStandardChallenge(BaseChallenge):
@@ -155,6 +834,85 @@ def get_chal_class(class_id):
 
 CHALLENGE_CLASSES = {"standard": CTFdStandardChallenge}
 
+challenges_api = Blueprint("challenges_api", __name__)
+
+
+@challenges_api.route("/api/admin/challenges/bulk_delete", methods=["POST"])
+@admins_only
+def bulk_delete():
+    data = request.get_json() or {}
+    challenge_ids = data.get("challenges")
+    if not isinstance(challenge_ids, list) or not all(
+        isinstance(challenge_id, int) for challenge_id in challenge_ids
+    ):
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "errors": {"challenges": "Expected a list of challenge ids"},
+                }
+            ),
+            400,
+        )
+
+    challenges = Challenges.query.filter(Challenges.id.in_(challenge_ids)).all()
+    deleted = sorted(challenge.id for challenge in challenges)
+    job_id = BaseChallenge.bulk_delete(challenges)
+    return jsonify(
+        {
+            "success": True,
+            "data": {
+                "challenges": deleted,
+                "file_cleanup": job_id,
+            },
+        }
+    )
+
+
+@challenges_api.route("/api/admin/challenges/fail_buffer")
+@admins_only
+def fail_buffer_stats():
+    return jsonify({"success": True, "data": fail_buffer.stats()})
+
+
+@challenges_api.route("/api/admin/challenges/file_cleanup")
+@admins_only
+def file_cleanup():
+    return jsonify({"success": True, "data": file_cleaner.stats()})
+
+
+@challenges_api.route("/api/admin/challenges/file_cleanup/<job_id>")
+@admins_only
+def file_cleanup_progress(job_id):
+    progress = file_cleaner.progress(job_id)
+    if progress is None:
+        abort(404)
+    return jsonify({"success": True, "data": progress})
+
+
+def discard_deleted_account_fails(response):
+    # CTFd deletes accounts through its own API; buffered fails of a deleted
+    # account would only be rejected by the next flush.
+    if request.method == "DELETE" and response.status_code < 400:
+        if request.endpoint == "api.users_user_public":
+            fail_buffer.discard(user_ids=[request.view_args["user_id"]])
+        elif request.endpoint == "api.teams_team_public":
+            fail_buffer.discard(team_ids=[request.view_args["team_id"]])
+    return response
+
 
 def load(app):
+    fail_buffer.size = app.config.get("FAIL_BUFFER_SIZE", 0)
+    fail_buffer.interval = app.config.get("FAIL_BUFFER_INTERVAL", 1.0)
+    fail_buffer.max_depth = app.config.get("FAIL_BUFFER_MAX_DEPTH", 100000)
+    fail_buffer.start(app)
+    app.after_request(discard_deleted_account_fails)
+    submission_throttle.rate = app.config.get("SUBMISSION_THROTTLE_RATE", 0)
+    submission_throttle.burst = app.config.get("SUBMISSION_THROTTLE_BURST", 10)
+    submission_throttle.maxsize = app.config.get("SUBMISSION_THROTTLE_BUCKETS", 65536)
+    wrong_submissions.ttl = app.config.get("SUBMISSION_DEDUPE_TTL", 0)
+    file_cleaner.retries = app.config.get("FILE_CLEANUP_RETRIES", 3)
+    file_cleaner.retry_delay = app.config.get("FILE_CLEANUP_RETRY_DELAY", 1.0)
+    file_cleaner.start(app)
+    app.register_blueprint(challenges_api)
     register_plugin_assets_directory(app, base_path="/plugins/challenges/assets/")
@@ -0,0 +1,287 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, func, select
+
+from CTFd.models import (
+    ChallengeFiles,
+    Challenges,
+    Fails,
+    Flags,
+    Hints,
+    Solves,
+    Tags,
+    Users,
+    db,
+)
+from CTFd.plugins import challenges as challenges_plugin
+from CTFd.plugins.challenges import (
+    BaseChallenge,
+    FailBuffer,
+    FileCleaner,
+    SubmissionPipeline,
+    SubmissionThrottle,
+    WrongSubmissionCache,
+    file_cleaner,
+)
+from CTFd.plugins.dynamic_challenges import DynamicChallenge
+
+
+@pytest.fixture
+def accounts(app):
+    with app.app_context():
+        challenge = Challenges(name="challenge", category="category", value=100)
+        user = Users(name="user", email="user@examplectf.com")
+        db.session.add_all([challenge, user])
+        db.session.commit()
+        return challenge.id, user.id
+
+
+def fail_record(challenge_id, user_id, provided, date):
+    return {
+        "user_id": user_id,
+        "team_id": None,
+        "challenge_id": challenge_id,
+        "ip": "127.0.0.1",
+        "provided": provided,
+        "type": "incorrect",
+        "date": date,
+    }
+
+
+def test_fail_buffer_flushes_in_date_order(app, accounts):
+    challenge_id, user_id = accounts
+    buffer = FailBuffer(size=10)
+    buffer.app = app
+    now = datetime.utcnow()
+    for i in (2, 0, 1):
+        buffer.add(
+            fail_record(challenge_id, user_id, "w%d" % i, now + timedelta(seconds=i))
+        )
+
+    assert buffer.flush() == 3
+    stats = buffer.stats()
+    assert stats["depth"] == 0
+    assert stats["flushed"] == 3
+    with app.app_context():
+        fails = Fails.query.order_by(Fails.id).all()
+        assert [fail.provided for fail in fails] == ["w0", "w1", "w2"]
+
+
+def test_fail_buffer_bounds_requeued_fails(app, accounts):
+    challenge_id, user_id = accounts
+    buffer = FailBuffer(size=10, max_depth=3)
+    buffer.app = app
+    # Rows the database rejects stand in for an unreachable database.
+    for i in range(2):
+        buffer.add(fail_record(challenge_id, user_id, "bad%d" % i, "not a date"))
+
+    assert buffer.flush() == 0
+    assert buffer.depth == 2
+    assert buffer.stats()["errors"] == 1
+
+    now = datetime.utcnow()
+    for i in range(2):
+        buffer.add(fail_record(challenge_id, user_id, "w%d" % i, now))
+    stats = buffer.stats()
+    assert stats["depth"] == 3
+    assert stats["dropped"] == 1
+
+    buffer.discard([challenge_id])
+    assert buffer.depth == 0
+
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+def test_fail_buffer_drops_rows_the_database_rejects(app, accounts):
+    challenge_id, user_id = accounts
+    buffer = FailBuffer(size=10)
+    buffer.app = app
+    with app.app_context():
+        event.listen(db.engine, "connect", enable_foreign_keys)
+        db.engine.dispose()
+    now = datetime.utcnow()
+    # A fail whose account was deleted inside the flush window.
+    for i, account_id in enumerate((user_id, user_id + 1, user_id)):
+        buffer.add(
+            fail_record(challenge_id, account_id, "w%d" % i, now + timedelta(seconds=i))
+        )
+
+    assert buffer.flush() == 2
+    stats = buffer.stats()
+    assert stats["depth"] == 0
+    assert stats["rejected"] == 1
+    assert stats["errors"] == 0
+    with app.app_context():
+        fails = Fails.query.order_by(Fails.id).all()
+        assert [fail.provided for fail in fails] == ["w0", "w2"]
+        event.remove(db.engine, "connect", enable_foreign_keys)
+
+
+def test_fail_buffer_discards_deleted_accounts():
+    buffer = FailBuffer(size=10)
+    now = datetime.utcnow()
+    buffer.add(fail_record(1, 1, "w0", now))
+    buffer.add(fail_record(1, 2, "w1", now))
+    buffer.add(dict(fail_record(1, 3, "w2", now), team_id=7))
+
+    buffer.discard(user_ids=[1], team_ids=[7])
+    assert [record["provided"] for record in buffer._records] == ["w1"]
+
+
+def test_submission_throttle_refills_tokens():
+    throttle = SubmissionThrottle(rate=1, burst=2)
+    assert throttle.allow("a", now=0)
+    assert throttle.allow("a", now=0)
+    assert not throttle.allow("a", now=0)
+    assert not throttle.allow("a", now=0.5)
+    assert throttle.allow("a", now=1.5)
+    assert not throttle.allow("a", now=1.5)
+    # Refills are capped at the burst size.
+    assert throttle.allow("a", now=100)
+    assert throttle.allow("a", now=100)
+    assert not throttle.allow("a", now=100)
+    assert throttle.throttled == 4
+
+
+def test_submission_throttle_evicts_least_recently_used():
+    throttle = SubmissionThrottle(rate=1, burst=1, maxsize=2)
+    assert throttle.allow("a", now=0)
+    assert throttle.allow("b", now=0)
+    assert not throttle.allow("a", now=0)
+    assert throttle.allow("c", now=0)
+    assert len(throttle) == 2
+    # "b" was evicted and starts over with a full bucket; "a" was not.
+    assert throttle.allow("b", now=0)
+    assert not throttle.allow("c", now=0)
+
+
+def test_wrong_submission_cache_expires_entries():
+    cache = WrongSubmissionCache(ttl=10)
+    result = (False, "Incorrect")
+    cache.put("key", "v1", result, now=0)
+    assert cache.get("key", "v1", now=5) == result
+    assert cache.get("key", "v2", now=5) is None
+    assert len(cache) == 0
+
+    cache.put("key", "v1", result, now=0)
+    assert cache.get("key", "v1", now=10) is None
+    assert cache.hits == 1
+
+
+def test_wrong_submission_cache_evicts_least_recently_used():
+    cache = WrongSubmissionCache(ttl=10, maxsize=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, "v", (False, key), now=0)
+    assert len(cache) == 2
+    assert cache.get("a", "v", now=1) is None
+    assert cache.get("c", "v", now=1) == (False, "c")
+
+
+def test_throttled_attempts_are_not_recorded(app, accounts):
+    challenge_id, user_id = accounts
+    with app.test_request_context(method="POST", json={"submission": "flag"}) as ctx:
+        user = Users.query.filter_by(id=user_id).first()
+        challenge = Challenges.query.filter_by(id=challenge_id).first()
+        pipeline = SubmissionPipeline.for_request(BaseChallenge, challenge, ctx.request)
+        pipeline.throttled = True
+        BaseChallenge.fail(user, None, challenge, ctx.request)
+        assert Fails.query.count() == 0
+
+        pipeline.throttled = False
+        BaseChallenge.fail(user, None, challenge, ctx.request)
+        assert Fails.query.count() == 1
+
+
+def test_bulk_delete_removes_challenges_and_their_rows(app):
+    with app.app_context():
+        user = Users(name="user", email="user@examplectf.com")
+        challenges = [
+            Challenges(name="standard%d" % i, category="category", value=100)
+            for i in range(3)
+        ]
+        challenges.append(
+            DynamicChallenge(
+                name="dynamic",
+                category="category",
+                initial=500,
+                minimum=100,
+                decay=10,
+                function="linear",
+            )
+        )
+        db.session.add(user)
+        db.session.add_all(challenges)
+        db.session.flush()
+        for challenge in challenges:
+            db.session.add_all(
+                [
+                    Flags(challenge_id=challenge.id, type="static", content="flag"),
+                    Tags(challenge_id=challenge.id, value="tag"),
+                    Hints(challenge_id=challenge.id, content="hint"),
+                    ChallengeFiles(
+                        challenge_id=challenge.id, location="%d/file" % challenge.id
+                    ),
+                    Solves(challenge_id=challenge.id, user_id=user.id, provided="f"),
+                    Fails(challenge_id=challenge.id, user_id=user.id, provided="x"),
+                ]
+            )
+        db.session.commit()
+        kept = challenges[0].id
+
+        job_id = BaseChallenge.bulk_delete(challenges[1:])
+
+        assert [challenge.id for challenge in Challenges.query.all()] == [kept]
+        # The type table is checked directly; a query on the model joins
+        # challenges and would not see orphaned rows.
+        dynamic_rows = db.session.execute(
+            select(func.count()).select_from(DynamicChallenge.__table__)
+        ).scalar()
+        assert dynamic_rows == 0
+        for model in (Flags, Tags, Hints, ChallengeFiles, Solves, Fails):
+            assert [row.challenge_id for row in model.query.all()] == [kept]
+        assert file_cleaner.progress(job_id)["total"] == 3
+
+
+def test_file_cleaner_retries_with_backoff(app, monkeypatch):
+    failures = {"a": 2, "b": 10}
+    deleted = []
+
+    class Uploader(object):
+        def delete(self, filename):
+            if failures.get(filename):
+                failures[filename] -= 1
+                raise OSError("busy")
+            deleted.append(filename)
+
+    monkeypatch.setattr(challenges_plugin, "get_uploader", Uploader)
+    cleaner = FileCleaner(retries=3, retry_delay=1)
+    cleaner.app = app
+    job_id = cleaner.enqueue(["a", "b", "c"], now=0)
+
+    assert cleaner.run_pending(now=0) == 3
+    assert cleaner.progress(job_id) == {
+        "total": 3,
+        "deleted": 1,
+        "failed": 0,
+        "retries": 2,
+        "pending": 2,
+    }
+    # Retries back off exponentially: 1, 2 and then 4 seconds.
+    assert cleaner.run_pending(now=0.5) == 0
+    assert cleaner.run_pending(now=1) == 2
+    assert cleaner.run_pending(now=2) == 0
+    assert cleaner.run_pending(now=3) == 2
+    assert cleaner.run_pending(now=7) == 1
+
+    assert deleted == ["c", "a"]
+    assert cleaner.progress(job_id) == {
+        "total": 3,
+        "deleted": 2,
+        "failed": 1,
+        "retries": 5,
+        "pending": 0,
+    }
+    assert cleaner.stats()["pending"] == 0
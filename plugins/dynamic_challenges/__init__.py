@@ -1,14 +1,51 @@
-from flask import Blueprint
+import atexit
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
 
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from sqlalchemy import bindparam, event, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+from CTFd.cache import clear_standings
 from CTFd.exceptions.challenges import (
     ChallengeCreateException,
     ChallengeUpdateException,
 )
-from CTFd.models import Challenges, db
+from CTFd.models import Challenges, Solves, Teams, Users, db
 from CTFd.plugins import register_plugin_assets_directory
-from CTFd.plugins.challenges import CHALLENGE_CLASSES, BaseChallenge
-from CTFd.plugins.dynamic_challenges.decay import DECAY_FUNCTIONS, logarithmic
+from CTFd.plugins.challenges import (
+    CHALLENGE_CLASSES,
+    BaseChallenge,
+    challenge_definitions,
+)
+from CTFd.plugins.dynamic_challenges.decay import (
+    DECAY_FUNCTIONS,
+    get_decay_table,
+    get_solve_counts_query,
+    invalidate_decay_table,
+    logarithmic,
+)
 from CTFd.plugins.migrations import upgrade
+from CTFd.utils import get_config
+from CTFd.utils.dates import unix_time_to_utc
+from CTFd.utils.decorators import admins_only
+from CTFd.utils.decorators.visibility import check_score_visibility
+from CTFd.utils.modes import get_model
+from CTFd.utils.user import is_admin
+
+log = logging.getLogger(__name__)
+
+SCOREBOARD_ENDPOINTS = (
+    "scoreboard.listing",
+    "api.scoreboard_scoreboard_list",
+    "api.scoreboard_scoreboard_detail",
+)
+
+TIMELINE_BATCH_SIZE = 500
 
 
 class DynamicChallenge(Challenges):
@@ -20,6 +57,7 @@ class DynamicChallenge(Challenges):
     minimum = db.Column(db.Integer, default=0)
     decay = db.Column(db.Integer, default=0)
     function = db.Column(db.String(32), default="logarithmic")
+    solve_count = db.Column(db.Integer, default=0)
 
     def __init__(self, *args, **kwargs):
         super(DynamicChallenge, self).__init__(**kwargs)
@@ -29,6 +67,20 @@ class DynamicChallenge(Challenges):
             raise ChallengeCreateException("Missing initial value for challenge")
 
 
+class DynamicValueHistory(db.Model):
+    __tablename__ = "dynamic_value_history"
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), index=True
+    )
+    solve_id = db.Column(
+        db.Integer, db.ForeignKey("submissions.id", ondelete="SET NULL"), index=True
+    )
+    value = db.Column(db.Integer)
+    solve_count = db.Column(db.Integer)
+    date = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class DynamicValueChallenge(BaseChallenge):
     id = "dynamic"
     name = "dynamic"
@@ -60,14 +112,23 @@ class DynamicValueChallenge(BaseChallenge):
         f = DECAY_FUNCTIONS.get(challenge.function, logarithmic)
         value = f(challenge)
 
+        if value != challenge.value:
+            db.session.add(
+                DynamicValueHistory(
+                    challenge_id=challenge.id,
+                    value=value,
+                    solve_count=challenge.solve_count,
+                )
+            )
         challenge.value = value
         db.session.commit()
         return challenge
 
     @classmethod
-    def read(cls, challenge):
-        challenge = DynamicChallenge.query.filter_by(id=challenge.id).first()
-        data = super().read(challenge)
+    def serialize(cls, challenge):
+        if not isinstance(challenge, DynamicChallenge):
+            challenge = DynamicChallenge.query.filter_by(id=challenge.id).first()
+        data = super().serialize(challenge)
         data.update(
             {
                 "initial": challenge.initial,
@@ -91,18 +152,503 @@ class DynamicValueChallenge(BaseChallenge):
                     raise ChallengeUpdateException(f"Invalid input for '{attr}'")
             setattr(challenge, attr, value)
 
-        return DynamicValueChallenge.calculate_value(challenge)
+        invalidate_decay_table(challenge.id)
+        challenge = DynamicValueChallenge.calculate_value(challenge)
+        challenge_definitions.invalidate()
+        return challenge
 
     @classmethod
-    def solve(cls, user, team, challenge, request):
-        super().solve(user, team, challenge, request)
+    def apply_solve(cls, user, team, challenge, solve):
+        account = team if team is not None else user
+        if account.hidden or account.banned:
+            return
+
+        # The counter UPDATE locks the challenge row until the solve commits,
+        # so concurrent solves are serialized and each value is derived from
+        # the count its own transaction produced. It has to run before the
+        # solve is inserted: on InnoDB that insert takes a shared lock on the
+        # challenges row through its foreign key, and two solvers holding
+        # one each would deadlock when either writes the value.
+        table = DynamicChallenge.__table__
+        with db.session.no_autoflush:
+            db.session.execute(
+                table.update()
+                .where(table.c.id == challenge.id)
+                .values(solve_count=table.c.solve_count + 1)
+            )
+        db.session.flush()
+        solve_count = db.session.execute(
+            select(table.c.solve_count).where(table.c.id == challenge.id)
+        ).scalar()
+        db.session.expire(challenge, ["solve_count"])
+
+        if value_recalculator.enabled:
+            db.session.info.setdefault("dynamic_values_pending", set()).add(
+                challenge.id
+            )
+            return
+
+        f = DECAY_FUNCTIONS.get(challenge.function, logarithmic)
+        challenge.value = f(challenge, solve_count=solve_count)
+        db.session.add(
+            DynamicValueHistory(
+                challenge_id=challenge.id,
+                solve_id=solve.id,
+                value=challenge.value,
+                solve_count=solve_count,
+            )
+        )
+
+
+class ValueRecalculator(object):
+    def __init__(self, window=0):
+        self.window = window
+        self.app = None
+        self.marked = 0
+        self.coalesced = 0
+        self.recalculated = 0
+        self.changed = 0
+        self.flushes = 0
+        self.forced_flushes = 0
+        self.errors = 0
+        self.last_flush_seconds = 0.0
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.window > 0
+
+    @property
+    def pending(self):
+        return len(self._dirty)
+
+    def start(self, app):
+        self.app = app
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="dynamic-values", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def mark(self, challenge_ids):
+        with self._lock:
+            for challenge_id in challenge_ids:
+                self.marked += 1
+                if challenge_id in self._dirty:
+                    self.coalesced += 1
+                else:
+                    self._dirty.add(challenge_id)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # Let the rest of the burst land before recalculating.
+            time.sleep(self.window)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self, force=False):
+        # Other workers only mark their own solves dirty, so a forced flush
+        # recalculates every dynamic challenge from its stored solve count
+        # instead of just the ids pending in this process.
+        with self._flush_lock:
+            with self._lock:
+                challenge_ids, self._dirty = self._dirty, set()
+                if force:
+                    self.forced_flushes += 1
+            if not challenge_ids and not force:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    changed = recalculate_challenge_values(
+                        None if force else challenge_ids
+                    )
+            except Exception:
+                log.exception("Failed to recalculate dynamic values")
+                with self._lock:
+                    self.errors += 1
+                    self._dirty.update(challenge_ids)
+                return 0
+
+            with self._lock:
+                self.flushes += 1
+                self.recalculated += len(challenge_ids)
+                self.changed += changed
+                self.last_flush_seconds = time.perf_counter() - start
+            return changed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._dirty),
+                "marked": self.marked,
+                "coalesced": self.coalesced,
+                "recalculated": self.recalculated,
+                "changed": self.changed,
+                "flushes": self.flushes,
+                "forced_flushes": self.forced_flushes,
+                "errors": self.errors,
+                "last_flush_seconds": self.last_flush_seconds,
+            }
+
+
+value_recalculator = ValueRecalculator()
+
+
+def recalculate_challenge_values(challenge_ids=None):
+    # A session of its own, so a forced flush never commits whatever the
+    # calling request has pending, and mapper listeners still see the writes.
+    # Without ids every dynamic challenge is recalculated.
+    session = Session(bind=db.engine)
+    changed = 0
+    try:
+        challenges = session.query(DynamicChallenge)
+        if challenge_ids is not None:
+            challenges = challenges.filter(DynamicChallenge.id.in_(challenge_ids))
+        for challenge in challenges:
+            f = DECAY_FUNCTIONS.get(challenge.function, logarithmic)
+            value = f(challenge, solve_count=challenge.solve_count or 0)
+            if value != challenge.value:
+                challenge.value = value
+                session.add(
+                    DynamicValueHistory(
+                        challenge_id=challenge.id,
+                        value=value,
+                        solve_count=challenge.solve_count,
+                    )
+                )
+                changed += 1
+        session.commit()
+    finally:
+        session.close()
+
+    if changed:
+        clear_standings()
+    return changed
+
+
+def reconcile_solve_counts(connection=None, fix=True):
+    # Counters are only adjusted by apply_solve(); anything else that changes the
+    # set of eligible solves (bans, hiding, deleted accounts or solves) is
+    # brought back in line here with one grouped count.
+    executor = connection if connection is not None else db.session
+    table = DynamicChallenge.__table__
+
+    actual = dict(executor.execute(get_solve_counts_query()).fetchall())
+    stored = executor.execute(select(table.c.id, table.c.solve_count)).fetchall()
+    drift = {
+        challenge_id: (solve_count, actual.get(challenge_id, 0))
+        for challenge_id, solve_count in stored
+        if solve_count != actual.get(challenge_id, 0)
+    }
+
+    if fix and drift:
+        executor.execute(
+            table.update()
+            .where(table.c.id == bindparam("challenge_id"))
+            .values(solve_count=bindparam("solve_count")),
+            [
+                {"challenge_id": challenge_id, "solve_count": solve_count}
+                for challenge_id, (_, solve_count) in drift.items()
+            ],
+        )
+        if connection is None:
+            db.session.commit()
+    return drift
+
+
+def recalculate_values(connection=None):
+    # Every dynamic challenge is re-evaluated from one grouped solve count
+    # and only the rows whose value or counter moved are written back.
+    executor = connection if connection is not None else db.session
+    dynamic = DynamicChallenge.__table__
+    challenges = Challenges.__table__
+
+    counts = dict(executor.execute(get_solve_counts_query()).fetchall())
+    rows = executor.execute(
+        select(
+            dynamic.c.id,
+            dynamic.c.initial,
+            dynamic.c.minimum,
+            dynamic.c.decay,
+            dynamic.c.function,
+            dynamic.c.solve_count,
+            challenges.c.value,
+        ).select_from(dynamic.join(challenges, challenges.c.id == dynamic.c.id))
+    ).fetchall()
+
+    values = {}
+    solve_counts = {}
+    for row in rows:
+        solve_count = counts.get(row.id, 0)
+        f = DECAY_FUNCTIONS.get(row.function, logarithmic)
+        value = f(SimpleNamespace(**row._asdict()), solve_count=solve_count)
+        if value != row.value:
+            values[row.id] = (row.value, value)
+        if solve_count != row.solve_count:
+            solve_counts[row.id] = (row.solve_count, solve_count)
 
-        DynamicValueChallenge.calculate_value(challenge)
+    if values:
+        executor.execute(
+            challenges.update()
+            .where(challenges.c.id == bindparam("challenge_id"))
+            .values(value=bindparam("value")),
+            [
+                {"challenge_id": challenge_id, "value": value}
+                for challenge_id, (_, value) in values.items()
+            ],
+        )
+        now = datetime.utcnow()
+        executor.execute(
+            DynamicValueHistory.__table__.insert(),
+            [
+                {
+                    "challenge_id": challenge_id,
+                    "value": value,
+                    "solve_count": counts.get(challenge_id, 0),
+                    "date": now,
+                }
+                for challenge_id, (_, value) in values.items()
+            ],
+        )
+    if solve_counts:
+        executor.execute(
+            dynamic.update()
+            .where(dynamic.c.id == bindparam("challenge_id"))
+            .values(solve_count=bindparam("solve_count")),
+            [
+                {"challenge_id": challenge_id, "solve_count": solve_count}
+                for challenge_id, (_, solve_count) in solve_counts.items()
+            ],
+        )
+    if connection is None:
+        db.session.commit()
+        # With a caller's connection the standings are cleared by the caller
+        # once its transaction commits, so they are never recached early.
+        if values:
+            clear_standings()
+    return {"challenges": len(rows), "values": values, "solve_counts": solve_counts}
+
+
+dynamic_challenges_api = Blueprint("dynamic_challenges_api", __name__)
+
+
+@dynamic_challenges_api.route(
+    "/api/admin/dynamic_challenges/recalculate", methods=["POST"]
+)
+@admins_only
+def recalculate():
+    result = recalculate_values()
+    return jsonify(
+        {
+            "success": True,
+            "data": {
+                "challenges": result["challenges"],
+                "values": {
+                    challenge_id: {"old": old, "new": new}
+                    for challenge_id, (old, new) in result["values"].items()
+                },
+                "solve_counts": {
+                    challenge_id: {"old": old, "new": new}
+                    for challenge_id, (old, new) in result["solve_counts"].items()
+                },
+            },
+        }
+    )
+
+
+def iter_score_timeline(before=None):
+    # Solves are read in date order in batches and only per-challenge running
+    # totals are kept, so memory grows with challenges, not with solves. Each
+    # solve is worth the value its challenge had right after it; solves
+    # without a history row are replayed through the decay table.
+    #
+    # As on the scoreboard, a decayed value reprices every earlier solver of
+    # the challenge. That is emitted once per change as a "decay" point with
+    # the per-solver "delta" and the number of "solvers" it applies to, so an
+    # account's score is the sum of its solve values plus the deltas of the
+    # challenges it had solved by then. ``before`` cuts the timeline off at
+    # the scoreboard freeze.
+    Model = get_model()
+    dynamic = {
+        row.id: row
+        for row in db.session.query(
+            DynamicChallenge.id,
+            DynamicChallenge.initial,
+            DynamicChallenge.minimum,
+            DynamicChallenge.decay,
+            DynamicChallenge.function,
+        )
+    }
+    solves = (
+        db.session.query(
+            Solves.account_id,
+            Solves.challenge_id,
+            Solves.date,
+            Challenges.value,
+            DynamicValueHistory.value,
+        )
+        .join(Challenges, Challenges.id == Solves.challenge_id)
+        .join(Model, Solves.account_id == Model.id)
+        .outerjoin(DynamicValueHistory, DynamicValueHistory.solve_id == Solves.id)
+        .filter(Model.hidden == False, Model.banned == False)
+    )
+    if before is not None:
+        solves = solves.filter(Solves.date < before)
+    solves = solves.order_by(Solves.date, Solves.id).yield_per(TIMELINE_BATCH_SIZE)
+
+    solve_counts = {}
+    values = {}
+    for account_id, challenge_id, date, value, history_value in solves:
+        date = date.isoformat() + "Z"
+        challenge = dynamic.get(challenge_id)
+        if challenge is not None:
+            solve_count = solve_counts.get(challenge_id, 0) + 1
+            solve_counts[challenge_id] = solve_count
+            if history_value is not None:
+                value = history_value
+            else:
+                value = get_decay_table(challenge).value(solve_count)
+        yield {
+            "type": "solve",
+            "account_id": account_id,
+            "challenge_id": challenge_id,
+            "date": date,
+            "value": value,
+        }
+        if challenge is None:
+            continue
+
+        previous = values.get(challenge_id, value)
+        values[challenge_id] = value
+        if value != previous:
+            yield {
+                "type": "decay",
+                "challenge_id": challenge_id,
+                "date": date,
+                "value": value,
+                "delta": value - previous,
+                "solvers": solve_count - 1,
+            }
+
+
+def stream_score_timeline(points):
+    yield '{"success": true, "data": ['
+    chunk = []
+    separator = ""
+    for point in points:
+        chunk.append(json.dumps(point))
+        if len(chunk) >= TIMELINE_BATCH_SIZE:
+            yield separator + ",".join(chunk)
+            separator = ","
+            chunk = []
+    if chunk:
+        yield separator + ",".join(chunk)
+    yield "]}"
+
+
+@dynamic_challenges_api.route("/api/dynamic_challenges/timeline")
+@check_score_visibility
+def timeline():
+    # Like the scoreboard, only admins see solves made after the freeze.
+    freeze = get_config("freeze")
+    before = unix_time_to_utc(freeze) if freeze and not is_admin() else None
+    return Response(
+        stream_with_context(stream_score_timeline(iter_score_timeline(before))),
+        mimetype="application/json",
+    )
+
+
+@dynamic_challenges_api.route("/api/admin/dynamic_challenges/metrics")
+@admins_only
+def metrics():
+    return jsonify({"success": True, "data": value_recalculator.stats()})
+
+
+def _on_account_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ("hidden", "banned")):
+        _mark_solve_counts_dirty(target)
+
+
+def _on_row_delete(mapper, connection, target):
+    _mark_solve_counts_dirty(target)
+
+
+def _mark_solve_counts_dirty(target):
+    session = object_session(target)
+    if session is not None:
+        session.info["dynamic_solve_counts_dirty"] = True
+
+
+def _on_after_commit(session):
+    pending = session.info.pop("dynamic_values_pending", None)
+    if pending:
+        value_recalculator.mark(pending)
+    if session.info.pop("dynamic_solve_counts_dirty", False):
+        # The committed session cannot emit SQL from this hook.
+        with db.engine.begin() as connection:
+            result = recalculate_values(connection=connection)
+        if result["values"]:
+            clear_standings()
+
+
+def _on_after_rollback(session):
+    session.info.pop("dynamic_values_pending", None)
+    session.info.pop("dynamic_solve_counts_dirty", None)
+
+
+def register_solve_count_listeners():
+    for model in (Users, Teams):
+        if not event.contains(model, "after_update", _on_account_update):
+            event.listen(model, "after_update", _on_account_update)
+        if not event.contains(model, "after_delete", _on_row_delete):
+            event.listen(model, "after_delete", _on_row_delete)
+    if not event.contains(Solves, "after_delete", _on_row_delete):
+        event.listen(Solves, "after_delete", _on_row_delete)
+    if not event.contains(Session, "after_commit", _on_after_commit):
+        event.listen(Session, "after_commit", _on_after_commit)
+        event.listen(Session, "after_rollback", _on_after_rollback)
 
 
 def load(app):
     upgrade(plugin_name="dynamic_challenges")
+    reconcile_solve_counts()
+    register_solve_count_listeners()
     CHALLENGE_CLASSES["dynamic"] = DynamicValueChallenge
+    app.register_blueprint(dynamic_challenges_api)
+
+    value_recalculator.window = app.config.get("DYNAMIC_VALUE_DEBOUNCE", 0)
+    value_recalculator.start(app)
+
+    @app.after_request
+    def recalculate_after_user_delete(response):
+        # CTFd deletes a user and their solves with query-level deletes,
+        # which never reach the mapper listeners.
+        if (
+            request.method == "DELETE"
+            and request.endpoint == "api.users_user_public"
+            and response.status_code < 400
+        ):
+            try:
+                recalculate_values()
+            except Exception:
+                log.exception("Failed to recalculate dynamic values")
+                db.session.rollback()
+        return response
+
+    @app.before_request
+    def flush_dynamic_values_for_scoreboard():
+        if request.endpoint in SCOREBOARD_ENDPOINTS and value_recalculator.enabled:
+            value_recalculator.flush(force=True)
     register_plugin_assets_directory(
         app, base_path="/plugins/dynamic_challenges/assets/"
     )
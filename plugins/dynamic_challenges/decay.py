@@ -2,11 +2,17 @@ from __future__ import division
 
 import math
 
+from sqlalchemy import func, select
+
 from CTFd.models import Solves
 from CTFd.utils.modes import get_model
 
 
 def get_solve_count(challenge):
+    solve_count = getattr(challenge, "solve_count", None)
+    if solve_count is not None:
+        return solve_count
+
     Model = get_model()
 
     solve_count = (
@@ -21,46 +27,129 @@ def get_solve_count(challenge):
     return solve_count
 
 
-def linear(challenge):
-    solve_count = get_solve_count(challenge)
-    if solve_count != 0:
+def get_solve_counts_query():
+    Model = get_model()
 
+    return (
+        select(Solves.challenge_id, func.count(Solves.id))
+        .select_from(Solves)
+        .join(Model, Solves.account_id == Model.id)
+        .where(Model.hidden == False, Model.banned == False)
+        .group_by(Solves.challenge_id)
+    )
+
+
+def linear_value(initial, minimum, decay, solve_count):
+    if solve_count != 0:
         solve_count -= 1
 
-    value = challenge.initial - (challenge.decay * solve_count)
+    value = initial - (decay * solve_count)
 
     value = math.ceil(value)
 
-    if value < challenge.minimum:
-        value = challenge.minimum
+    if value < minimum:
+        value = minimum
 
     return value
 
 
-def logarithmic(challenge):
-    solve_count = get_solve_count(challenge)
+def logarithmic_value(initial, minimum, decay, solve_count):
     if solve_count != 0:
-
         solve_count -= 1
 
+    if decay == 0:
+        decay = 1
 
-    if challenge.decay == 0:
-        challenge.decay = 1
-
-
-    value = (
-        ((challenge.minimum - challenge.initial) / (challenge.decay**2))
-        * (solve_count**2)
-    ) + challenge.initial
+    value = (((minimum - initial) / (decay**2)) * (solve_count**2)) + initial
 
     value = math.ceil(value)
 
-    if value < challenge.minimum:
-        value = challenge.minimum
+    if value < minimum:
+        value = minimum
 
     return value
 
 
+MAX_TABLE_SIZE = 10000
+
+
+class DecayTable(object):
+    def __init__(self, formula, initial, minimum, decay):
+        self.formula = formula
+        self.params = (formula, initial, minimum, decay)
+        self.settled = False
+        self.values = []
+
+        if formula is linear_value:
+            falling, flat = decay >= 0, decay == 0
+        else:
+            falling, flat = minimum <= initial, minimum == initial
+
+        # Once a non-increasing curve hits the minimum (or is flat) every
+        # later solve count has the same value, so the table can stop.
+        for solve_count in range(MAX_TABLE_SIZE):
+            value = formula(initial, minimum, decay, solve_count)
+            self.values.append(value)
+            if solve_count >= 1 and falling and (flat or value == minimum):
+                self.settled = True
+                break
+
+    def value(self, solve_count):
+        if solve_count < len(self.values):
+            return self.values[solve_count]
+        if self.settled:
+            return self.values[-1]
+        return self.formula(*self.params[1:], solve_count)
+
+    def curve(self, solve_count):
+        return [self.value(i) for i in range(solve_count + 1)]
+
+
+_tables = {}
+
+
+def get_decay_table(challenge, formula=None):
+    if formula is None:
+        formula = VALUE_FUNCTIONS.get(challenge.function, logarithmic_value)
+    params = (formula, challenge.initial, challenge.minimum, challenge.decay)
+    key = getattr(challenge, "id", None)
+
+    table = _tables.get(key) if key is not None else None
+    if table is None or table.params != params:
+        table = DecayTable(*params)
+        if key is not None:
+            _tables[key] = table
+    return table
+
+
+def invalidate_decay_table(challenge_id=None):
+    if challenge_id is None:
+        _tables.clear()
+    else:
+        _tables.pop(challenge_id, None)
+
+
+def value_curve(challenge, solve_count):
+    return get_decay_table(challenge).curve(solve_count)
+
+
+def linear(challenge, solve_count=None):
+    if solve_count is None:
+        solve_count = get_solve_count(challenge)
+    return get_decay_table(challenge, linear_value).value(solve_count)
+
+
+def logarithmic(challenge, solve_count=None):
+    if solve_count is None:
+        solve_count = get_solve_count(challenge)
+    return get_decay_table(challenge, logarithmic_value).value(solve_count)
+
+
+VALUE_FUNCTIONS = {
+    "linear": linear_value,
+    "logarithmic": logarithmic_value,
+}
+
 DECAY_FUNCTIONS = {
     "linear": linear,
     "logarithmic": logarithmic,
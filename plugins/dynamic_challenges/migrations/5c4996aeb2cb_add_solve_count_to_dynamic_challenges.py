@@ -0,0 +1,35 @@
+"""Add solve_count column to dynamic_challenges
+
+Revision ID: 5c4996aeb2cb
+Revises: eb68f277ab61
+Create Date: 2026-10-17 11:02:31.518203
+
+"""
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_columns_for_table
+
+revision = "5c4996aeb2cb"
+down_revision = "eb68f277ab61"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    columns = get_columns_for_table(
+        op=op, table_name="dynamic_challenge", names_only=True
+    )
+    if "solve_count" not in columns:
+        # Filled in by reconcile_solve_counts() when the plugin loads.
+        op.add_column(
+            "dynamic_challenge",
+            sa.Column("solve_count", sa.Integer(), nullable=True, server_default="0"),
+        )
+
+
+def downgrade(op=None):
+    columns = get_columns_for_table(
+        op=op, table_name="dynamic_challenge", names_only=True
+    )
+    if "solve_count" in columns:
+        op.drop_column("dynamic_challenge", "solve_count")
@@ -0,0 +1,48 @@
+"""Add dynamic_value_history table
+
+Revision ID: 9a1d0c3e7f42
+Revises: 5c4996aeb2cb
+Create Date: 2026-10-17 14:20:05.731448
+
+"""
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables
+
+revision = "9a1d0c3e7f42"
+down_revision = "5c4996aeb2cb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    if "dynamic_value_history" not in get_all_tables(op=op):
+        op.create_table(
+            "dynamic_value_history",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("challenge_id", sa.Integer(), nullable=True),
+            sa.Column("solve_id", sa.Integer(), nullable=True),
+            sa.Column("value", sa.Integer(), nullable=True),
+            sa.Column("solve_count", sa.Integer(), nullable=True),
+            sa.Column("date", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(
+                ["challenge_id"], ["challenges.id"], ondelete="CASCADE"
+            ),
+            sa.ForeignKeyConstraint(
+                ["solve_id"], ["submissions.id"], ondelete="SET NULL"
+            ),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index(
+            "ix_dynamic_value_history_challenge_id",
+            "dynamic_value_history",
+            ["challenge_id"],
+        )
+        op.create_index(
+            "ix_dynamic_value_history_solve_id", "dynamic_value_history", ["solve_id"]
+        )
+
+
+def downgrade(op=None):
+    if "dynamic_value_history" in get_all_tables(op=op):
+        op.drop_table("dynamic_value_history")
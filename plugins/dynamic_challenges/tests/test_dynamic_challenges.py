@@ -0,0 +1,426 @@
+import calendar
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask import Blueprint
+from sqlalchemy.orm import Session
+
+from CTFd import create_app
+from CTFd.config import TestingConfig
+from CTFd.models import Solves, Teams, Users, db
+from CTFd.plugins import dynamic_challenges
+from CTFd.plugins.challenges import SubmissionPipeline
+from CTFd.plugins.dynamic_challenges import (
+    DynamicChallenge,
+    DynamicValueChallenge,
+    DynamicValueHistory,
+    ValueRecalculator,
+    iter_score_timeline,
+    recalculate_values,
+)
+from CTFd.plugins.dynamic_challenges.decay import (
+    get_decay_table,
+    linear,
+    linear_value,
+    logarithmic,
+    logarithmic_value,
+    value_curve,
+)
+from CTFd.utils import set_config
+
+
+def test_concurrent_solves_update_value_atomically(app):
+    threads = 32
+
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        db.session.add(challenge)
+        accounts = []
+        for i in range(threads):
+            team = Teams(name="team%d" % i, email="team%d@examplectf.com" % i)
+            db.session.add(team)
+            db.session.flush()
+            user = Users(
+                name="user%d" % i, email="user%d@examplectf.com" % i, team_id=team.id
+            )
+            db.session.add(user)
+            db.session.flush()
+            accounts.append((user.id, team.id))
+        db.session.commit()
+        challenge_id = challenge.id
+
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def solve(user_id, team_id):
+        try:
+            with app.test_request_context(
+                method="POST", json={"submission": "flag"}
+            ) as ctx:
+                user = Users.query.filter_by(id=user_id).first()
+                team = Teams.query.filter_by(id=team_id).first()
+                challenge = DynamicChallenge.query.filter_by(id=challenge_id).first()
+                barrier.wait()
+                DynamicValueChallenge.solve(user, team, challenge, ctx.request)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=solve, args=account) for account in accounts]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    with app.app_context():
+        challenge = DynamicChallenge.query.filter_by(id=challenge_id).first()
+        assert Solves.query.filter_by(challenge_id=challenge_id).count() == threads
+        assert challenge.solve_count == threads
+        assert challenge.value == linear(challenge, solve_count=threads)
+
+
+def test_duplicate_solves_are_recorded_once(app):
+    threads = 100
+
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        team = Teams(name="team", email="team@examplectf.com")
+        db.session.add_all([challenge, team])
+        db.session.flush()
+        user = Users(name="user", email="user@examplectf.com", team_id=team.id)
+        db.session.add(user)
+        db.session.commit()
+        challenge_id, team_id, user_id = challenge.id, team.id, user.id
+
+    barrier = threading.Barrier(threads)
+    solve_ids = []
+    errors = []
+
+    def solve():
+        try:
+            with app.test_request_context(
+                method="POST", json={"submission": "flag"}
+            ) as ctx:
+                user = Users.query.filter_by(id=user_id).first()
+                team = Teams.query.filter_by(id=team_id).first()
+                challenge = DynamicChallenge.query.filter_by(id=challenge_id).first()
+                barrier.wait()
+                solve = DynamicValueChallenge.solve(user, team, challenge, ctx.request)
+                solve_ids.append(solve.id)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=solve) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert len(solve_ids) == threads
+    assert len(set(solve_ids)) == 1
+    with app.app_context():
+        challenge = DynamicChallenge.query.filter_by(id=challenge_id).first()
+        assert Solves.query.filter_by(challenge_id=challenge_id).count() == 1
+        history = DynamicValueHistory.query.filter_by(challenge_id=challenge_id)
+        assert history.count() == 1
+        assert challenge.solve_count == 1
+        assert challenge.value == linear(challenge, solve_count=1)
+
+
+def test_solve_committed_by_another_session_is_not_counted_twice(app, monkeypatch):
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        team = Teams(name="team", email="team@examplectf.com")
+        db.session.add_all([challenge, team])
+        db.session.flush()
+        user = Users(name="user", email="user@examplectf.com", team_id=team.id)
+        db.session.add(user)
+        db.session.commit()
+        challenge_id, team_id, user_id = challenge.id, team.id, user.id
+
+        # Another process records the same solve, counter included, between
+        # the existing-solve check and the insert, past the in-process lock.
+        find_solve = SubmissionPipeline.find_solve
+        raced = []
+
+        def racing_find_solve(self, user, team):
+            if not raced:
+                raced.append(True)
+                session = Session(bind=db.engine)
+                solve = Solves(
+                    user_id=user_id, team_id=team_id, challenge_id=challenge_id
+                )
+                session.add(solve)
+                table = DynamicChallenge.__table__
+                session.execute(
+                    table.update()
+                    .where(table.c.id == challenge_id)
+                    .values(solve_count=table.c.solve_count + 1)
+                )
+                session.commit()
+                raced.append(solve.id)
+                session.close()
+                return None
+            return find_solve(self, user, team)
+
+        monkeypatch.setattr(SubmissionPipeline, "find_solve", racing_find_solve)
+        with app.test_request_context(
+            method="POST", json={"submission": "flag"}
+        ) as ctx:
+            solve = DynamicValueChallenge.solve(user, team, challenge, ctx.request)
+
+        assert solve.id == raced[1]
+        db.session.expire_all()
+        challenge = DynamicChallenge.query.filter_by(id=challenge_id).first()
+        assert Solves.query.filter_by(challenge_id=challenge_id).count() == 1
+        history = DynamicValueHistory.query.filter_by(challenge_id=challenge_id)
+        assert history.count() == 0
+        assert challenge.solve_count == 1
+        assert challenge.value == 500
+
+
+def test_user_delete_recalculates_values():
+    app = create_app(TestingConfig)
+    api = Blueprint("api", __name__)
+
+    # Stands in for CTFd's user DELETE endpoint, which skips the ORM.
+    @api.route("/api/v1/users/<int:user_id>", methods=["DELETE"])
+    def users_user_public(user_id):
+        Solves.query.filter_by(user_id=user_id).delete()
+        Users.query.filter_by(id=user_id).delete()
+        db.session.commit()
+        return {"success": True}
+
+    app.register_blueprint(api)
+
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        db.session.add(challenge)
+        user_ids = []
+        for i in range(2):
+            team = Teams(name="team%d" % i, email="team%d@examplectf.com" % i)
+            db.session.add(team)
+            db.session.flush()
+            user = Users(
+                name="user%d" % i, email="user%d@examplectf.com" % i, team_id=team.id
+            )
+            db.session.add(user)
+            db.session.commit()
+            with app.test_request_context(
+                method="POST", json={"submission": "flag"}
+            ) as ctx:
+                DynamicValueChallenge.solve(user, team, challenge, ctx.request)
+            user_ids.append(user.id)
+        challenge_id = challenge.id
+
+    response = app.test_client().delete("/api/v1/users/%d" % user_ids[0])
+    assert response.status_code == 200
+    with app.app_context():
+        challenge = DynamicChallenge.query.filter_by(id=challenge_id).first()
+        assert challenge.solve_count == 1
+        assert challenge.value == linear(challenge, solve_count=1)
+
+
+def test_recalculate_values_clears_standings(monkeypatch):
+    app = create_app(TestingConfig)
+    cleared = []
+    monkeypatch.setattr(
+        dynamic_challenges, "clear_standings", lambda: cleared.append(True)
+    )
+
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        db.session.add(challenge)
+        db.session.commit()
+        assert recalculate_values()["values"] == {}
+        assert cleared == []
+
+        challenge.value = 1
+        db.session.commit()
+        assert recalculate_values()["values"] == {challenge.id: (1, 500)}
+        assert cleared == [True]
+
+
+def test_forced_flush_covers_solves_marked_by_other_workers():
+    app = create_app(TestingConfig)
+    recalculator = ValueRecalculator(window=1)
+    recalculator.app = app
+
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        db.session.add(challenge)
+        db.session.commit()
+        # Another worker counted two solves and marked them in its own
+        # process only.
+        challenge.solve_count = 2
+        db.session.commit()
+        challenge_id = challenge.id
+
+    assert recalculator.flush() == 0
+    assert recalculator.flush(force=True) == 1
+    with app.app_context():
+        challenge = DynamicChallenge.query.filter_by(id=challenge_id).first()
+        assert challenge.value == linear(challenge, solve_count=2)
+
+
+def test_score_timeline_reprices_earlier_solvers():
+    app = create_app(TestingConfig)
+
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        db.session.add(challenge)
+        team_ids = []
+        for i in range(3):
+            team = Teams(name="team%d" % i, email="team%d@examplectf.com" % i)
+            db.session.add(team)
+            db.session.flush()
+            user = Users(
+                name="user%d" % i, email="user%d@examplectf.com" % i, team_id=team.id
+            )
+            db.session.add(user)
+            db.session.commit()
+            with app.test_request_context(
+                method="POST", json={"submission": "flag"}
+            ) as ctx:
+                DynamicValueChallenge.solve(user, team, challenge, ctx.request)
+            team_ids.append(team.id)
+
+        points = list(iter_score_timeline())
+        scores = {}
+        solvers = {}
+        for point in points:
+            if point["type"] == "solve":
+                account_id = point["account_id"]
+                scores[account_id] = scores.get(account_id, 0) + point["value"]
+                solvers.setdefault(point["challenge_id"], []).append(account_id)
+            else:
+                earlier = solvers[point["challenge_id"]][:-1]
+                assert point["solvers"] == len(earlier)
+                for account_id in earlier:
+                    scores[account_id] += point["delta"]
+        assert scores == {team_id: challenge.value for team_id in team_ids}
+        assert [point["type"] for point in points] == [
+            "solve",
+            "solve",
+            "decay",
+            "solve",
+            "decay",
+        ]
+
+
+def test_score_timeline_hides_solves_after_freeze():
+    app = create_app(TestingConfig)
+    now = datetime.utcnow()
+
+    with app.app_context():
+        challenge = DynamicChallenge(
+            name="dynamic",
+            category="dynamic",
+            initial=500,
+            minimum=100,
+            decay=10,
+            function="linear",
+        )
+        db.session.add(challenge)
+        for i, date in enumerate((now - timedelta(hours=1), now + timedelta(hours=1))):
+            team = Teams(name="team%d" % i, email="team%d@examplectf.com" % i)
+            db.session.add(team)
+            db.session.flush()
+            user = Users(
+                name="user%d" % i, email="user%d@examplectf.com" % i, team_id=team.id
+            )
+            db.session.add(user)
+            db.session.commit()
+            with app.test_request_context(
+                method="POST", json={"submission": "flag"}
+            ) as ctx:
+                solve = DynamicValueChallenge.solve(user, team, challenge, ctx.request)
+            solve.date = date
+            db.session.commit()
+
+    set_config("freeze", calendar.timegm(now.utctimetuple()))
+    try:
+        data = app.test_client().get("/api/dynamic_challenges/timeline").get_json()
+    finally:
+        set_config("freeze", None)
+    assert [point["type"] for point in data["data"]] == ["solve"]
+
+
+def test_decay_tables_match_formulas():
+    for formula in (linear_value, logarithmic_value):
+        for initial, minimum, decay in [
+            (500, 100, 10),
+            (500, 100, 0),
+            (100, 500, 10),
+            (500.0, 100.0, 3.5),
+            (500, 500, 7),
+            (500, 100, -5),
+        ]:
+            challenge = SimpleNamespace(
+                id=None, initial=initial, minimum=minimum, decay=decay
+            )
+            table = get_decay_table(challenge, formula)
+            for solve_count in range(200):
+                assert table.value(solve_count) == formula(
+                    initial, minimum, decay, solve_count
+                )
+
+
+def test_logarithmic_has_no_side_effects():
+    challenge = SimpleNamespace(
+        id=None, initial=500, minimum=100, decay=0, function="logarithmic"
+    )
+    assert logarithmic(challenge, solve_count=3) == 100
+    assert challenge.decay == 0
+    assert value_curve(challenge, 2) == [500, 500, 100]
@@ -1,7 +1,32 @@
+import hashlib
+import hmac
+import logging
+import os
 import re
+import signal
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from uuid import uuid4
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from CTFd.cache import cache
+from CTFd.models import Flags, db
 from CTFd.plugins import register_plugin_assets_directory
 
+try:
+    import regex
+except ImportError:
+    regex = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_REGEX_CACHE_SIZE = 1024
+DEFAULT_MATCHER_CACHE_SIZE = 4096
+FLAG_MATCHERS_VERSION_KEY = "flag_matchers_version"
+
 
 class FlagException(Exception):
     def __init__(self, message):
@@ -11,6 +36,122 @@ class FlagException(Exception):
         return self.message
 
 
+class RegexTimeout(Exception):
+    pass
+
+
+class RegexCache(object):
+    def __init__(self, maxsize=DEFAULT_REGEX_CACHE_SIZE, engine=re):
+        self.maxsize = maxsize
+        self.engine = engine
+        self.timeout = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.timeouts = 0
+        self._patterns = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content, case_insensitive=False):
+        key = (content, case_insensitive)
+        with self._lock:
+            pattern = self._patterns.get(key)
+            if pattern is not None:
+                self._patterns.move_to_end(key)
+                self.hits += 1
+                return pattern
+            self.misses += 1
+
+        try:
+            pattern = self.engine.compile(
+                content, self.engine.IGNORECASE if case_insensitive else 0
+            )
+        except self.engine.error as e:
+            raise FlagException("Regex parse error occured") from e
+
+        with self._lock:
+            self._patterns[key] = pattern
+            self._patterns.move_to_end(key)
+            while len(self._patterns) > self.maxsize:
+                self._patterns.popitem(last=False)
+                self.evictions += 1
+        return pattern
+
+    def match(self, content, provided, case_insensitive=False, full=False):
+        pattern = self.get(content, case_insensitive)
+        match = pattern.fullmatch if full else pattern.match
+        if not self.timeout:
+            return match(provided)
+        try:
+            if self.engine is regex:
+                return match(provided, timeout=self.timeout)
+            if not deadline_available():
+                # SIGALRM only fires on the main thread. Refuse the match
+                # rather than run a pattern without its time limit.
+                raise FlagException("Regex match could not be time limited")
+            with match_deadline(self.timeout):
+                return match(provided)
+        except (RegexTimeout, TimeoutError) as e:
+            with self._lock:
+                self.timeouts += 1
+            raise FlagException("Regex match timed out") from e
+
+    def configure(self, maxsize=None, timeout=None):
+        if maxsize is not None:
+            self.maxsize = maxsize
+        self.timeout = timeout
+        # The regex module enforces the timeout inside the matcher, which
+        # also works off the main thread, so prefer it when installed.
+        engine = regex if timeout and regex is not None else re
+        if timeout and regex is None:
+            log.warning(
+                "FLAG_REGEX_TIMEOUT is set but the regex module is not installed; "
+                "regex flags will be rejected outside the main thread"
+            )
+        if engine is not self.engine:
+            self.engine = engine
+            self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._patterns.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._patterns),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "timeouts": self.timeouts,
+            }
+
+
+def deadline_available():
+    return (
+        hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+
+
+@contextmanager
+def match_deadline(timeout):
+    def on_timeout(signum, frame):
+        raise RegexTimeout()
+
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+regex_cache = RegexCache()
+
+
 class BaseFlag(object):
     name = None
     templates = {}
@@ -34,15 +175,18 @@ class CTFdStaticFlag(BaseFlag):
 
         if len(saved) != len(provided):
             return False
-        result = 0
 
         if data == "case_insensitive":
-            for x, y in zip(saved.lower(), provided.lower()):
-                result |= ord(x) ^ ord(y)
-        else:
-            for x, y in zip(saved, provided):
-                result |= ord(x) ^ ord(y)
-        return result == 0
+            saved, provided = saved.lower(), provided.lower()
+            # lower() can change the length; only the common prefix has
+            # ever been compared.
+            if len(saved) != len(provided):
+                length = min(len(saved), len(provided))
+                saved, provided = saved[:length], provided[:length]
+        return hmac.compare_digest(
+            saved.encode("utf-8", "surrogatepass"),
+            provided.encode("utf-8", "surrogatepass"),
+        )
 
 
 class CTFdRegexFlag(BaseFlag):
@@ -57,19 +201,185 @@ class CTFdRegexFlag(BaseFlag):
         saved = chal_key_obj.content
         data = chal_key_obj.data
 
-        try:
-            if data == "case_insensitive":
-                res = re.match(saved, provided, re.IGNORECASE)
+        res = regex_cache.match(saved, provided, data == "case_insensitive")
+        return res and res.group() == provided
+
+
+FLAG_CLASSES = {"static": CTFdStaticFlag, "regex": CTFdRegexFlag}
+
+FlagRow = namedtuple("FlagRow", ["type", "content", "data"])
+
+# Static flags are stored and looked up as keyed digests, so set lookups
+# never compare submissions against flag contents directly.
+DIGEST_KEY = os.urandom(32)
+
+# Backreferences, conditional groups and (with the regex module) group
+# recursion all refer to group numbers, which the alternation renumbers.
+GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?(?:P=|P>|\(|&|R\)|[+-]?\d)")
+
+
+def flag_digest(value):
+    return hmac.new(
+        DIGEST_KEY, value.encode("utf-8", "surrogatepass"), hashlib.sha256
+    ).digest()
+
+
+class FlagMatcher(object):
+    def __init__(self, flags):
+        self.legacy = False
+        self.static = set()
+        self.folded = set()
+        self.regexes = []
+        self.uncombined = []
+        self.combined = None
+
+        for flag in flags:
+            flag_class = FLAG_CLASSES.get(flag.type)
+            if flag_class is CTFdStaticFlag:
+                if flag.data == "case_insensitive":
+                    folded = flag.content.lower()
+                    # str.lower() can change the length, which the
+                    # per-flag compare handles differently from equality.
+                    if len(folded) != len(flag.content):
+                        self.legacy = True
+                    self.folded.add(flag_digest(folded))
+                else:
+                    self.static.add(flag_digest(flag.content))
+            elif flag_class is CTFdRegexFlag:
+                try:
+                    regex_cache.get(flag.content, flag.data == "case_insensitive")
+                except FlagException:
+                    self.legacy = True
+                self.regexes.append(flag)
             else:
-                res = re.match(saved, provided)
+                self.legacy = True
 
-        except re.error as e:
-            raise FlagException("Regex parse error occured") from e
+        if self.legacy or len(self.regexes) < 2:
+            self.uncombined = self.regexes
+            return
 
-        return res and res.group() == provided
+        # Combined patterns are only a filter: a submission that cannot
+        # fullmatch any alternative cannot pass the per-flag compare either.
+        combinable = [
+            f for f in self.regexes if not GROUP_REFERENCE.search(f.content)
+        ]
+        self.uncombined = [f for f in self.regexes if f not in combinable]
+        combined = "|".join(
+            "(?%s:%s)" % ("i" if f.data == "case_insensitive" else "", f.content)
+            for f in combinable
+        )
+        try:
+            regex_cache.get(combined)
+        except FlagException:
+            self.uncombined = self.regexes
+        else:
+            self.combined = combined
 
+    def match(self, provided):
+        if self.legacy:
+            return None
 
-FLAG_CLASSES = {"static": CTFdStaticFlag, "regex": CTFdRegexFlag}
+        if flag_digest(provided) in self.static:
+            return True, "Correct"
+        if self.folded:
+            folded = provided.lower()
+            if len(folded) != len(provided):
+                return None
+            if flag_digest(folded) in self.folded:
+                return True, "Correct"
+
+        try:
+            candidates = self.regexes
+            if self.combined is not None and not regex_cache.match(
+                self.combined, provided, full=True
+            ):
+                candidates = self.uncombined
+            for flag in candidates:
+                if CTFdRegexFlag.compare(flag, provided):
+                    return True, "Correct"
+        except FlagException as e:
+            return False, str(e)
+        return False, "Incorrect"
+
+
+class FlagMatcherCache(object):
+    def __init__(self, maxsize=DEFAULT_MATCHER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.version = None
+        self._matchers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, challenge_id):
+        version = get_matchers_version()
+        with self._lock:
+            if version != self.version:
+                self._matchers.clear()
+                self.version = version
+            matcher = self._matchers.get(challenge_id)
+            if matcher is not None:
+                self._matchers.move_to_end(challenge_id)
+                return matcher
+
+        rows = (
+            db.session.query(Flags.type, Flags.content, Flags.data)
+            .filter_by(challenge_id=challenge_id)
+            .order_by(Flags.id)
+            .all()
+        )
+        matcher = FlagMatcher([FlagRow(*row) for row in rows])
+
+        with self._lock:
+            if self.version == version:
+                self._matchers[challenge_id] = matcher
+                while len(self._matchers) > self.maxsize:
+                    self._matchers.popitem(last=False)
+        return matcher
+
+    def invalidate(self):
+        # The version lives in the shared cache so every worker rebuilds,
+        # not just the one that handled the write.
+        cache.set(FLAG_MATCHERS_VERSION_KEY, uuid4().hex, timeout=0)
+        with self._lock:
+            self._matchers.clear()
+            self.version = None
+
+    def __len__(self):
+        return len(self._matchers)
+
+
+def get_matchers_version():
+    version = cache.get(FLAG_MATCHERS_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.set(FLAG_MATCHERS_VERSION_KEY, version, timeout=0)
+    return version
+
+
+flag_matchers = FlagMatcherCache()
+
+
+def _on_flag_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info["flag_matchers_dirty"] = True
+
+
+def _on_after_commit(session):
+    if session.info.pop("flag_matchers_dirty", False):
+        flag_matchers.invalidate()
+
+
+def _on_after_rollback(session):
+    session.info.pop("flag_matchers_dirty", None)
+
+
+def register_flag_listeners():
+    for name in ("after_insert", "after_update", "after_delete"):
+        if not event.contains(Flags, name, _on_flag_change):
+            event.listen(Flags, name, _on_flag_change, propagate=True)
+    if not event.contains(Session, "after_commit", _on_after_commit):
+        event.listen(Session, "after_commit", _on_after_commit)
+        event.listen(Session, "after_rollback", _on_after_rollback)
 
 
 def get_flag_class(class_id):
@@ -80,4 +390,12 @@ def get_flag_class(class_id):
 
 
 def load(app):
+    regex_cache.configure(
+        maxsize=app.config.get("FLAG_REGEX_CACHE_SIZE", DEFAULT_REGEX_CACHE_SIZE),
+        timeout=app.config.get("FLAG_REGEX_TIMEOUT"),
+    )
+    flag_matchers.maxsize = app.config.get(
+        "FLAG_MATCHER_CACHE_SIZE", DEFAULT_MATCHER_CACHE_SIZE
+    )
+    register_flag_listeners()
     register_plugin_assets_directory(app, base_path="/plugins/flags/assets/")
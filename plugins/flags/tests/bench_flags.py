@@ -0,0 +1,40 @@
+"""Micro-benchmark for CTFdStaticFlag.compare against the old per-character loop.
+
+    python -m CTFd.plugins.flags.tests.bench_flags
+"""
+import timeit
+
+from CTFd.plugins.flags import CTFdStaticFlag
+from CTFd.plugins.flags.tests.test_flags import legacy_static_compare
+
+
+def main():
+    flag = CTFdStaticFlag()
+    for length in (32, 1024, 16384):
+        for data in ("", "case_insensitive"):
+            flag.content = "flag{" + "x" * (length - 6) + "}"
+            flag.data = data
+            provided = flag.content.upper() if data else flag.content
+            number = max(10, 200000 // length)
+
+            legacy = timeit.timeit(
+                lambda: legacy_static_compare(flag.content, provided, flag.data),
+                number=number,
+            )
+            current = timeit.timeit(
+                lambda: flag.compare(flag, provided), number=number
+            )
+            print(
+                "len=%-6d %-17s legacy=%8.2fus current=%8.2fus x%.1f"
+                % (
+                    length,
+                    data or "case_sensitive",
+                    legacy / number * 1e6,
+                    current / number * 1e6,
+                    legacy / current,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,17 @@
-from CTFd.plugins.flags import CTFdRegexFlag
+import random
+import threading
+
+import pytest
+
+from CTFd.plugins import flags
+from CTFd.plugins.flags import (
+    CTFdRegexFlag,
+    CTFdStaticFlag,
+    FlagException,
+    FlagMatcher,
+    FlagRow,
+    RegexCache,
+)
 
 
 def test_valid_regex_match_case_sensitive():
@@ -23,3 +36,144 @@ def test_invalid_regex_match():
     flag.data = "case_sensitive"
     provided_flag = "invalid"
     assert not flag.compare(flag, provided_flag)
+
+
+def test_regex_cache_reuses_compiled_patterns():
+    cache = RegexCache(maxsize=2)
+    first = cache.get(r"^flag\{\w+\}$")
+    assert cache.get(r"^flag\{\w+\}$") is first
+    assert cache.get(r"^flag\{\w+\}$", case_insensitive=True) is not first
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_regex_cache_evicts_least_recently_used():
+    cache = RegexCache(maxsize=2)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    cache.get("c")
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+    cache.get("a")
+    assert cache.stats()["hits"] == 2
+
+
+def test_regex_cache_parse_error():
+    cache = RegexCache()
+    with pytest.raises(FlagException):
+        cache.get("flag{[")
+
+
+def test_regex_match_timeout():
+    cache = RegexCache()
+    cache.configure(timeout=0.05)
+    with pytest.raises(FlagException):
+        cache.match(r"^(a|aa)+$", "a" * 64 + "b")
+    assert cache.stats()["timeouts"] == 1
+    assert cache.match(r"^a+$", "aaa")
+
+
+def test_regex_match_timeout_fails_closed_off_main_thread(monkeypatch):
+    monkeypatch.setattr(flags, "regex", None)
+    cache = RegexCache()
+    cache.configure(timeout=0.05)
+    errors = []
+
+    def match():
+        try:
+            cache.match(r"^a+$", "aaa")
+        except FlagException as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=match)
+    worker.start()
+    worker.join()
+    assert len(errors) == 1
+
+
+def test_flag_matcher_static():
+    matcher = FlagMatcher(
+        [
+            FlagRow("static", "flag{Case}", ""),
+            FlagRow("static", "flag{fold}", "case_insensitive"),
+        ]
+    )
+    assert matcher.match("flag{Case}") == (True, "Correct")
+    assert matcher.match("flag{case}") == (False, "Incorrect")
+    assert matcher.match("FLAG{FOLD}") == (True, "Correct")
+
+
+def test_flag_matcher_combined_regex():
+    matcher = FlagMatcher(
+        [
+            FlagRow("regex", r"a|ab", ""),
+            FlagRow("regex", r"flag\{\d+\}", "case_insensitive"),
+            FlagRow("regex", r"(x)\1", ""),
+        ]
+    )
+    assert matcher.combined is not None
+    assert matcher.match("FLAG{42}") == (True, "Correct")
+    assert matcher.match("xx") == (True, "Correct")
+    # Only the leftmost match counts, as in CTFdRegexFlag.compare.
+    assert matcher.match("ab") == (False, "Incorrect")
+
+    # Conditional groups refer to group numbers too, so they stay uncombined.
+    matcher = FlagMatcher(
+        [
+            FlagRow("regex", r"(?P<x>a)b", ""),
+            FlagRow("regex", r"(a)(?(1)b|c)", "case_insensitive"),
+        ]
+    )
+    assert [f.content for f in matcher.uncombined] == [r"(a)(?(1)b|c)"]
+    assert matcher.match("aB") == (True, "Correct")
+    assert matcher.match("ac") == (False, "Incorrect")
+
+
+def test_flag_matcher_defers_to_per_flag_compare():
+    assert FlagMatcher([FlagRow("regex", "flag{[", "")]).match("x") is None
+    assert FlagMatcher([FlagRow("custom", "x", "")]).match("x") is None
+
+
+def legacy_static_compare(saved, provided, data):
+    if len(saved) != len(provided):
+        return False
+    result = 0
+    if data == "case_insensitive":
+        for x, y in zip(saved.lower(), provided.lower()):
+            result |= ord(x) ^ ord(y)
+    else:
+        for x, y in zip(saved, provided):
+            result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+def test_static_compare_matches_legacy_loop():
+    rng = random.Random(0)
+    alphabet = "aAbB\u0130i\u0307\u00df\u00e9\U0001f600{}_0\ud800"
+    flag = CTFdStaticFlag()
+    for _ in range(5000):
+        flag.content = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+        flag.data = rng.choice(["", "case_insensitive"])
+        if rng.random() < 0.3:
+            provided = flag.content
+        elif rng.random() < 0.5:
+            provided = flag.content.swapcase()
+        else:
+            provided = "".join(
+                rng.choice(alphabet) for _ in range(rng.randint(0, 6))
+            )
+        assert flag.compare(flag, provided) == legacy_static_compare(
+            flag.content, provided, flag.data
+        ), (flag.content, provided, flag.data)
+
+
+def test_static_compare_long_flags():
+    flag = CTFdStaticFlag()
+    flag.content = "flag{" + "a1" * 4096 + "}"
+    flag.data = ""
+    assert flag.compare(flag, flag.content)
+    assert not flag.compare(flag, flag.content[:-2] + "b}")
+    flag.data = "case_insensitive"
+    assert flag.compare(flag, flag.content.upper())
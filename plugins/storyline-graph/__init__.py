@@ -1,16 +1,44 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for
+from flask import (
+    Blueprint, Response, render_template, request, jsonify, redirect, url_for, make_response,
+    stream_with_context,
+)
 from CTFd.models import db, Challenges, Solves, Users, Teams
 from CTFd.utils.decorators import admins_only, authed_only
-from CTFd.utils.user import get_current_user, get_current_team
+from CTFd.utils.user import get_current_user, get_current_team, get_current_team_attrs
 from CTFd.plugins import register_plugin_assets_directory, override_template, bypass_csrf_protection
 from CTFd.plugins import register_plugin_asset
+from CTFd.plugins.challenges import register_solve_hook
 from CTFd.utils import get_config, set_config
 from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime, timedelta
+import hashlib
 import json
 from pathlib import Path
 
+from .broker import LocalBroker
+from .changelog import DEFAULT_CHANGELOG_SIZE, GraphChangeLog
+from .expiry import ExpiryScheduler, load_expiry_entries
+from .graph_index import (
+    get_attributes_version,
+    get_challenge_attributes,
+    get_graph_index,
+    get_graph_version,
+    invalidate_challenge_attributes,
+    invalidate_graph_index,
+    register_graph_listeners,
+)
+from .metrics import graph_metrics
+from .team_state import (
+    DEFAULT_TEAM_CACHE_SIZE,
+    SolveDelta,
+    TeamState,
+    TeamStateCache,
+    apply_solve,
+    compute_unlocked,
+    compute_visible,
+)
+
 
 class StorylineChallenge(db.Model):
     __tablename__ = 'storyline_challenges'
@@ -38,143 +66,193 @@ class SolutionDescription(db.Model):
     challenge = relationship("Challenges")
 
 
-def get_unlocked_challenges_for_team(team_id):
-    if not team_id:
-        return []
+team_state_cache = TeamStateCache()
+expiry_scheduler = ExpiryScheduler()
+event_broker = LocalBroker()
+graph_changelog = GraphChangeLog()
 
-    solved_challenges = db.session.query(Solves.challenge_id, Solves.date).filter_by(team_id=team_id).all()
-    solved_ids = [solve.challenge_id for solve in solved_challenges]
-    solved_dict = {solve.challenge_id: solve.date for solve in solved_challenges}
+EVENTS_HEARTBEAT = 15
+EVENTS_POLL_TIMEOUT = 25
 
-    storyline_challenges = StorylineChallenge.query.all()
-    storyline_dict = {sc.challenge_id: sc for sc in storyline_challenges}
 
-    unlocked_ids = set()
+def get_solve_marker(team_id):
+    count, last_solve_id = db.session.query(
+        db.func.count(Solves.id), db.func.max(Solves.id)
+    ).filter(Solves.team_id == team_id).one()
+    return (count, last_solve_id)
 
-    for challenge in Challenges.query.all():
-        if challenge.id in storyline_dict:
-            sc = storyline_dict[challenge.id]
+def sync_expiry_scheduler(index, now):
+    if expiry_scheduler.graph_version != index.version:
+        expiry_scheduler.load(index.version, load_expiry_entries(index, now))
+    expiry_scheduler.fire_due(now)
 
-            if not sc.predecessor_id:
-                unlocked_ids.add(challenge.id)
-            elif sc.predecessor_id in solved_ids:
-                predecessor_solve_time = solved_dict[sc.predecessor_id]
+def schedule_team_deadlines(team_id, deadlines, now):
+    for challenge_id, expires_at in deadlines.items():
+        if expires_at >= now:
+            expiry_scheduler.schedule(team_id, challenge_id, expires_at)
 
-                if sc.max_lifetime:
-                    time_limit = timedelta(minutes=sc.max_lifetime)
-                    if datetime.utcnow() - predecessor_solve_time <= time_limit:
-                        unlocked_ids.add(challenge.id)
-                else:
-                    unlocked_ids.add(challenge.id)
+def on_branch_expired(team_id, challenge_id, expires_at):
+    team_state_cache.invalidate(team_id)
+    event_broker.publish(team_id, 'expired', {
+        'challenge_id': challenge_id,
+        'expires_at': expires_at.isoformat() + 'Z',
+    })
+
+def publish_solve_delta(delta):
+    event_broker.publish(delta.team_id, 'solved', {'challenge_id': delta.challenge_id})
+    if delta.unlocked:
+        event_broker.publish(delta.team_id, 'unlocked', {
+            'challenge_ids': delta.unlocked,
+            'timers': {
+                str(challenge_id): expires_at.isoformat() + 'Z'
+                for challenge_id, expires_at in delta.timers_started.items()
+            },
+        })
+
+def get_team_state(team_id):
+    index = get_graph_index()
+    now = datetime.utcnow()
+    sync_expiry_scheduler(index, now)
+
+    # Without a cached state for this graph the marker cannot save a rebuild,
+    # so load the solves straight away and derive the marker from them.
+    solves = None
+    cached = team_state_cache.peek(team_id)
+    with graph_metrics.phase('query'):
+        if cached is None or cached.graph_version != index.version:
+            solves = db.session.query(Solves.id, Solves.challenge_id, Solves.date).filter_by(team_id=team_id).all()
+            marker = (len(solves), max((solve.id for solve in solves), default=None))
         else:
-            unlocked_ids.add(challenge.id)
+            marker = get_solve_marker(team_id)
+
+    state = team_state_cache.get(team_id, index.version, marker, now)
+    if state is None:
+        with graph_metrics.phase('query'):
+            if solves is None:
+                solves = db.session.query(Solves.challenge_id, Solves.date).filter_by(team_id=team_id).all()
+            solved_dict = {solve.challenge_id: solve.date for solve in solves}
+        with graph_metrics.phase('unlock'):
+            unlocked, deadlines = compute_unlocked(index, solved_dict, now)
+        with graph_metrics.phase('visibility'):
+            visible = compute_visible(index, solved_dict, unlocked)
+        state = TeamState(index.version, marker, solved_dict, unlocked, visible, deadlines)
+        team_state_cache.put(team_id, state)
+        schedule_team_deadlines(team_id, state.deadlines, now)
+    return state
 
-    return list(unlocked_ids)
+def get_unlocked_challenges_for_team(team_id):
+    if not team_id:
+        return []
 
-def get_graph_data(team_id=None):
-    challenges = Challenges.query.all()
-    storyline_challenges = StorylineChallenge.query.all()
+    return list(get_team_state(team_id).unlocked)
+
+def on_team_solve(team_id, challenge_id):
+    index = get_graph_index()
+    marker = get_solve_marker(team_id)
+    now = datetime.utcnow()
+    state = team_state_cache.peek(team_id)
+
+    # The cached state can be advanced in place only if this solve is the
+    # one change since it was computed; otherwise fall back to a rebuild.
+    if (state is None or
+        state.graph_version != index.version or
+        state.marker[0] != marker[0] - 1 or
+        challenge_id in state.solved or
+        (state.expires_at is not None and now > state.expires_at)):
+        team_state_cache.invalidate(team_id)
+        previous = state
+        state = get_team_state(team_id)
+        unlocked = sorted(state.unlocked - previous.unlocked) if previous else sorted(state.unlocked)
+        timers_started = {
+            cid: expires_at for cid, expires_at in state.deadlines.items()
+            if previous is None or cid not in previous.deadlines
+        }
+        return SolveDelta(team_id, challenge_id, unlocked, timers_started)
+
+    solve_date = db.session.query(Solves.date).filter_by(
+        team_id=team_id, challenge_id=challenge_id
+    ).order_by(Solves.id.desc()).limit(1).scalar()
+    if solve_date is None:
+        team_state_cache.invalidate(team_id)
+        return SolveDelta(team_id, challenge_id, [], {})
+
+    state, delta = apply_solve(index, state, team_id, challenge_id, solve_date, marker, now)
+    team_state_cache.put(team_id, state)
+    schedule_team_deadlines(team_id, delta.timers_started, now)
+    return delta
+
+def on_challenge_solved(submission):
+    team = submission.team
+    if not team:
+        return
+    try:
+        publish_solve_delta(on_team_solve(team.id, submission.challenge.id))
+    except Exception as e:
+        team_state_cache.invalidate(team.id)
+        print(f" * Could not refresh storyline state for team {team.id}: {e}")
 
-    storyline_dict = {sc.challenge_id: sc for sc in storyline_challenges}
-    challenge_dict = {c.id: c for c in challenges}
+def get_graph_data(team_id=None):
+    index = get_graph_index()
 
     nodes = []
     edges = []
 
-    solved_ids = set()
-    unlocked_ids = set()
-    
-    if team_id:
-        solved_challenges = Solves.query.filter_by(team_id=team_id).all()
-        solved_ids = {solve.challenge_id for solve in solved_challenges}
-        unlocked_ids = set(get_unlocked_challenges_for_team(team_id))
-    else:
-        unlocked_ids = {c.id for c in challenges}
-
-    visible_challenge_ids = set()
     if team_id:
-        visible_challenge_ids = solved_ids.copy()
-        
-        for challenge_id in unlocked_ids:
-            if challenge_id in storyline_dict:
-                sc = storyline_dict[challenge_id]
-                if (sc.predecessor_id is None or 
-                    sc.predecessor_id in solved_ids or 
-                    sc.predecessor_id in unlocked_ids):
-                    visible_challenge_ids.add(challenge_id)
-            else:
-                visible_challenge_ids.add(challenge_id)
+        state = get_team_state(team_id)
+        solved_ids = set(state.solved)
+        unlocked_ids = state.unlocked
+        visible_challenge_ids = state.visible
+        deadlines = state.deadlines
     else:
-        visible_challenge_ids = {c.id for c in challenges}
+        deadlines = {}
+        solved_ids = set()
+        unlocked_ids = set(index.nodes)
+        visible_challenge_ids = unlocked_ids
 
-    added_node_ids = set()
-    
-    for challenge in challenges:
-        if challenge.id not in visible_challenge_ids:
-            continue
-            
+    attributes = get_challenge_attributes()
 
-        if challenge.id in added_node_ids:
-            continue
+    with graph_metrics.phase('serialization'):
+        for node in index.nodes.values():
+            challenge = attributes.get(node.id)
+            if node.id not in visible_challenge_ids or challenge is None:
+                continue
             
-        status = 'locked'
-        if team_id:
-            if challenge.id in solved_ids:
-                status = 'solved'
-            elif challenge.id in unlocked_ids:
+            status = 'locked'
+            if team_id:
+                if node.id in solved_ids:
+                    status = 'solved'
+                elif node.id in unlocked_ids:
+                    status = 'unlocked'
+            else:
                 status = 'unlocked'
-        else:
-            status = 'unlocked'
-
-        node = {
-            'id': challenge.id,
-            'label': challenge.name,
-            'status': status,
-            'category': challenge.category,
-            'value': challenge.value
-        }
-
-        if challenge.id in storyline_dict:
-            sc = storyline_dict[challenge.id]
-            if sc.max_lifetime:
-                node['max_lifetime'] = sc.max_lifetime
-
-        nodes.append(node)
-        added_node_ids.add(challenge.id)
-
-
-    added_edges = set()
-    
-    for sc in storyline_challenges:
-        if (sc.predecessor_id and 
-            sc.predecessor_id in visible_challenge_ids and 
-            sc.challenge_id in visible_challenge_ids):
-            
-            edge_key = (sc.predecessor_id, sc.challenge_id)
-            
-            if edge_key in added_edges:
-                continue
-                
-            edges.append({
-                'from': sc.predecessor_id,
-                'to': sc.challenge_id,
-                'has_timer': sc.max_lifetime is not None
-            })
-            added_edges.add(edge_key)
-
-
-    if team_id:
-        print(f" * Debug for team {team_id}:")
-        print(f"   - Total challenges: {len(challenges)}")
-        print(f"   - Solved challenges: {len(solved_ids)} - {list(solved_ids)}")
-        print(f"   - Unlocked challenges: {len(unlocked_ids)} - {list(unlocked_ids)}")
-        print(f"   - Visible challenges: {len(visible_challenge_ids)} - {list(visible_challenge_ids)}")
-        print(f"   - Storyline challenges: {len(storyline_challenges)}")
-        for sc in storyline_challenges:
-            challenge_name = challenge_dict.get(sc.challenge_id, {}).name if sc.challenge_id in challenge_dict else f"ID:{sc.challenge_id}"
-            predecessor_name = challenge_dict.get(sc.predecessor_id, {}).name if sc.predecessor_id and sc.predecessor_id in challenge_dict else f"ID:{sc.predecessor_id}"
-            print(f"     {challenge_name} <- {predecessor_name if sc.predecessor_id else 'ROOT'}")
 
+            node_data = {
+                'id': node.id,
+                'label': challenge.name,
+                'status': status,
+                'category': challenge.category,
+                'value': challenge.value
+            }
+
+            if node.max_lifetime:
+                node_data['max_lifetime'] = node.max_lifetime
+
+            expires_at = deadlines.get(node.id) if status == 'unlocked' else None
+            node_data['expires_at'] = expires_at.isoformat() + 'Z' if expires_at else None
+
+            nodes.append(node_data)
+
+        for predecessor_id, challenge_id, max_lifetime in index.edges:
+            if (predecessor_id in visible_challenge_ids and 
+                challenge_id in visible_challenge_ids):
+                edges.append({
+                    'from': predecessor_id,
+                    'to': challenge_id,
+                    'has_timer': max_lifetime is not None
+                })
+
+    graph_metrics.inc('storyline_graph_nodes_total', len(nodes))
+    graph_metrics.inc('storyline_graph_edges_total', len(edges))
     return {'nodes': nodes, 'edges': edges}
 
 
@@ -199,19 +277,157 @@ def player_graph():
     graph_data = get_graph_data(team_id)
     return render_template('player_graph.html', graph_data=json.dumps(graph_data))
 
+def get_graph_etag(team_id=None):
+    parts = [get_graph_version(), get_attributes_version()]
+    if team_id:
+        # The open deadlines come from the team's solves, not from this
+        # worker's scheduler, so every worker agrees on when a branch expires.
+        state = get_team_state(team_id)
+        solve_count, last_solve_id = state.marker
+        parts += [team_id, solve_count, last_solve_id, state.expires_at.isoformat() if state.expires_at else '']
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+def graph_response(team_id=None):
+    etag = get_graph_etag(team_id)
+    if request.if_none_match.contains(etag):
+        graph_metrics.inc('storyline_graph_responses_total', result='not_modified')
+        response = make_response('', 304)
+    else:
+        graph_metrics.inc('storyline_graph_responses_total', result='full')
+        response = jsonify(get_graph_data(team_id))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+def get_last_event_id(value):
+    try:
+        last_id = int(value)
+    except (TypeError, ValueError):
+        return event_broker.last_id, False
+    # Ids are per process; one we have never issued means the client was
+    # talking to another worker and has to resync from the full graph.
+    if last_id > event_broker.last_id:
+        return event_broker.last_id, True
+    return last_id, False
+
+def wait_for_team_events(team_id, after, timeout):
+    next_deadline = expiry_scheduler.next_deadline(team_id)
+    if next_deadline:
+        remaining = (next_deadline - datetime.utcnow()).total_seconds()
+        timeout = min(timeout, max(remaining, 0) + 1)
+
+    events = event_broker.wait(team_id, after, timeout)
+    if not events:
+        # Nothing else fires timers without a request, so waiting clients do.
+        sync_expiry_scheduler(get_graph_index(), datetime.utcnow())
+        events = event_broker.since(team_id, after)
+    return events
+
+def stream_team_events(team_id, after, resync):
+    yield 'retry: 5000\n\n'
+    if resync:
+        yield format_event(after, 'refresh', {})
+
+    etag = get_graph_etag(team_id)
+    db.session.remove()
+
+    while True:
+        events = wait_for_team_events(team_id, after, EVENTS_HEARTBEAT)
+        for event_id, event_type, data in events:
+            after = event_id
+            yield format_event(event_id, event_type, data)
+
+        # Solves handled by another worker never reach this broker, the
+        # ETag check turns them into a refresh on the next heartbeat.
+        current = get_graph_etag(team_id)
+        db.session.remove()
+        if current != etag and not events:
+            yield format_event(after, 'refresh', {})
+        elif not events:
+            yield ': keep-alive\n\n'
+        etag = current
+
+@storyline_bp.route('/api/storyline/events')
+@authed_only
+def api_events():
+    team = get_current_team_attrs()
+    if not team:
+        return jsonify({'error': 'No team found'}), 400
+
+    after, resync = get_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('after')
+    )
+    response = Response(
+        stream_with_context(stream_team_events(team.id, after, resync)),
+        mimetype='text/event-stream',
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@storyline_bp.route('/api/storyline/events/poll')
+@authed_only
+def api_events_poll():
+    team = get_current_team_attrs()
+    if not team:
+        return jsonify({'error': 'No team found'}), 400
+
+    after, resync = get_last_event_id(request.args.get('after'))
+    timeout = min(request.args.get('timeout', EVENTS_POLL_TIMEOUT, type=float), EVENTS_POLL_TIMEOUT)
+
+    events = [] if resync else wait_for_team_events(team.id, after, max(timeout, 0))
+    return jsonify({
+        'resync': resync,
+        'last_id': events[-1][0] if events else after,
+        'events': [
+            {'id': event_id, 'type': event_type, 'data': data}
+            for event_id, event_type, data in events
+        ],
+    })
+
 @storyline_bp.route('/api/storyline/graph')
 @authed_only
 def api_graph():
-    team = get_current_team()
+    team = get_current_team_attrs()
     team_id = team.id if team else None
-    graph_data = get_graph_data(team_id)
-    return jsonify(graph_data)
+
+    since = request.args.get('since')
+    if since is None or not team_id:
+        return graph_response(team_id)
+
+    etag = get_graph_etag(team_id)
+    data = graph_changelog.delta(team_id, etag, since, lambda: get_graph_data(team_id))
+    graph_metrics.inc('storyline_graph_responses_total', result='snapshot' if data['full'] else 'delta')
+    response = jsonify(data)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @storyline_bp.route('/api/admin/storyline/graph')
 @admins_only
 def api_admin_graph():
-    graph_data = get_graph_data()
-    return jsonify(graph_data)
+    return graph_response()
+
+@storyline_bp.route('/api/admin/storyline/metrics')
+@admins_only
+def api_admin_metrics():
+    index = get_graph_index()
+    body = graph_metrics.render(
+        counters=[
+            ('storyline_team_cache_requests_total', {'result': 'hit'}, team_state_cache.hits),
+            ('storyline_team_cache_requests_total', {'result': 'miss'}, team_state_cache.misses),
+        ],
+        gauges=[
+            ('storyline_graph_rows', {'kind': 'challenges'}, len(index.nodes)),
+            ('storyline_graph_rows', {'kind': 'storyline'}, len(index.storyline)),
+            ('storyline_graph_rows', {'kind': 'edges'}, len(index.edges)),
+            ('storyline_team_cache_entries', {}, len(team_state_cache)),
+            ('storyline_expiry_scheduled', {}, len(expiry_scheduler)),
+        ],
+    )
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 @storyline_bp.route('/api/admin/storyline/challenge/<int:challenge_id>', methods=['POST'])
 @admins_only
@@ -233,6 +449,7 @@ def update_storyline_challenge(challenge_id):
     sc.max_lifetime = max_lifetime if max_lifetime else None
 
     db.session.commit()
+    invalidate_graph_index()
 
     return jsonify({'success': True})
 
@@ -336,6 +553,7 @@ def cleanup_storyline_data(challenge_id):
         SolutionDescription.query.filter_by(challenge_id=challenge_id).delete()
         
         db.session.commit()
+        invalidate_graph_index()
         print(f" * Cleaned up storyline data for challenge {challenge_id}")
     except Exception as e:
         print(f" * Error cleaning up storyline data for challenge {challenge_id}: {e}")
@@ -436,6 +654,13 @@ def load(app):
             print(" * Run migration_fix_cascade.py manually if deletion errors persist")
 
 
+    team_state_cache.maxsize = app.config.get('STORYLINE_TEAM_CACHE_SIZE', DEFAULT_TEAM_CACHE_SIZE)
+    graph_metrics.enabled = bool(app.config.get('STORYLINE_METRICS', False))
+    graph_changelog.max_teams = team_state_cache.maxsize
+    graph_changelog.max_entries = app.config.get('STORYLINE_CHANGELOG_SIZE', DEFAULT_CHANGELOG_SIZE)
+    register_graph_listeners()
+    register_solve_hook(on_challenge_solved, after_commit=True)
+    expiry_scheduler.register_callback(on_branch_expired)
     app.register_blueprint(storyline_bp)
     
 
@@ -459,11 +684,40 @@ def load(app):
                     StorylineChallenge.query.filter_by(predecessor_id=challenge_id).update({'predecessor_id': None})
                     SolutionDescription.query.filter_by(challenge_id=challenge_id).delete()
                     db.session.commit()
+                    invalidate_graph_index()
                     print(f" * Pre-cleaned storyline data for challenge {challenge_id}")
                 except Exception as e:
                     print(f" * Pre-cleanup error for challenge {challenge_id}: {e}")
                     db.session.rollback()
 
+    # Bans, hides, the bulk dynamic recalculation and bulk deletes change
+    # challenges with plain SQL, which the mapper listeners never see. Only
+    # creating or deleting challenges changes the graph topology.
+    value_endpoints = (
+        'api.challenges_challenge_list',
+        'api.challenges_challenge',
+        'api.teams_team_public',
+        'api.users_user_public',
+        'dynamic_challenges_api.recalculate',
+        'challenges_api.bulk_delete',
+    )
+    topology_requests = (
+        ('POST', 'api.challenges_challenge_list'),
+        ('DELETE', 'api.challenges_challenge'),
+        ('POST', 'challenges_api.bulk_delete'),
+    )
+
+    @app.after_request
+    def invalidate_storyline_on_challenge_change(response):
+        if (request.method in ('POST', 'PATCH', 'DELETE') and
+            request.endpoint in value_endpoints and
+            response.status_code < 400):
+            if (request.method, request.endpoint) in topology_requests:
+                invalidate_graph_index()
+            else:
+                invalidate_challenge_attributes()
+        return response
+
 
     dir_path = Path(__file__).parent
     register_plugin_assets_directory(
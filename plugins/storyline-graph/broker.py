@@ -0,0 +1,49 @@
+import threading
+from collections import deque
+
+
+DEFAULT_BACKLOG = 64
+
+
+class LocalBroker(object):
+    """In-process fan-out of storyline events, one channel per team.
+
+    Every event gets a process-wide sequence number and the last ``backlog``
+    events of each team are kept, so a reconnecting SSE client (Last-Event-ID)
+    or a long-poll request (``after``) only receives what it missed.
+    """
+
+    def __init__(self, backlog=DEFAULT_BACKLOG):
+        self.backlog = backlog
+        self._events = {}
+        self._last_id = 0
+        self._cond = threading.Condition()
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, team_id, event_type, data):
+        with self._cond:
+            self._last_id += 1
+            events = self._events.get(team_id)
+            if events is None:
+                events = self._events[team_id] = deque(maxlen=self.backlog)
+            events.append((self._last_id, event_type, data))
+            self._cond.notify_all()
+            return self._last_id
+
+    def _since(self, team_id, after):
+        events = self._events.get(team_id)
+        if not events or events[-1][0] <= after:
+            return []
+        return [event for event in events if event[0] > after]
+
+    def since(self, team_id, after):
+        with self._cond:
+            return self._since(team_id, after)
+
+    def wait(self, team_id, after, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self._since(team_id, after), timeout)
+            return self._since(team_id, after)
@@ -0,0 +1,167 @@
+import threading
+from collections import OrderedDict, deque
+from uuid import uuid4
+
+
+DEFAULT_CHANGELOG_SIZE = 32
+
+
+def node_fingerprint(node):
+    return hash(tuple(sorted(node.items())))
+
+
+def edge_key(edge):
+    return (edge['from'], edge['to'], edge['has_timer'])
+
+
+class TeamChangeLog(object):
+    __slots__ = ('log_id', 'sequence', 'etag', 'nodes', 'edges', 'entries')
+
+    def __init__(self, max_entries):
+        # A fresh id per log makes versions handed out before an eviction
+        # (or by another worker) unknown, which forces a full snapshot.
+        self.log_id = uuid4().hex[:8]
+        self.sequence = 0
+        self.etag = None
+        self.nodes = {}
+        self.edges = set()
+        self.entries = deque(maxlen=max_entries)
+
+    @property
+    def version(self):
+        return '%s.%d' % (self.log_id, self.sequence)
+
+    def record(self, etag, graph):
+        nodes = {node['id']: node_fingerprint(node) for node in graph['nodes']}
+        edges = {edge_key(edge) for edge in graph['edges']}
+
+        if self.etag is not None:
+            added = [i for i in nodes if i not in self.nodes]
+            removed = [i for i in self.nodes if i not in nodes]
+            changed = [i for i, fp in nodes.items() if i in self.nodes and self.nodes[i] != fp]
+            if added or removed or changed or edges != self.edges:
+                self.sequence += 1
+                self.entries.append((
+                    self.sequence, added, removed, changed,
+                    edges - self.edges, self.edges - edges,
+                ))
+
+        self.etag = etag
+        self.nodes = nodes
+        self.edges = edges
+
+    def changes_since(self, sequence):
+        if sequence == self.sequence:
+            return set(), set(), set(), set(), set()
+        if sequence > self.sequence or not self.entries or self.entries[0][0] > sequence + 1:
+            return None
+
+        # Fold the entries into one change set relative to what the client
+        # had at ``sequence``: ids first seen as added were never sent.
+        existed = {}
+        edges_existed = {}
+        for entry_sequence, added, removed, changed, edges_added, edges_removed in self.entries:
+            if entry_sequence <= sequence:
+                continue
+            for i in added:
+                existed.setdefault(i, False)
+            for i in removed:
+                existed.setdefault(i, True)
+            for i in changed:
+                existed.setdefault(i, True)
+            for key in edges_added:
+                edges_existed.setdefault(key, False)
+            for key in edges_removed:
+                edges_existed.setdefault(key, True)
+
+        added = {i for i, was in existed.items() if not was and i in self.nodes}
+        changed = {i for i, was in existed.items() if was and i in self.nodes}
+        removed = {i for i, was in existed.items() if was and i not in self.nodes}
+        edges_added = {k for k, was in edges_existed.items() if not was and k in self.edges}
+        edges_removed = {k for k, was in edges_existed.items() if was and k not in self.edges}
+        return added, removed, changed, edges_added, edges_removed
+
+
+class GraphChangeLog(object):
+    """Bounded per-team history of graph payload changes.
+
+    Only fingerprints of the last payload and the ids touched by each change
+    are kept; node bodies for a delta come from the current graph.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CHANGELOG_SIZE, max_teams=4096):
+        self.max_entries = max_entries
+        self.max_teams = max_teams
+        self._logs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, team_id):
+        with self._lock:
+            log = self._logs.get(team_id)
+            if log is not None:
+                self._logs.move_to_end(team_id)
+            return log
+
+    def delta(self, team_id, etag, since, load_graph):
+        log = self.get(team_id)
+        if log is not None and log.etag == etag and since == log.version:
+            with self._lock:
+                return build_delta(log, since, {'nodes': [], 'edges': []})
+
+        graph = load_graph()
+        with self._lock:
+            log = self._logs.get(team_id)
+            if log is None:
+                log = self._logs[team_id] = TeamChangeLog(self.max_entries)
+            self._logs.move_to_end(team_id)
+            while len(self._logs) > self.max_teams:
+                self._logs.popitem(last=False)
+            if log.etag != etag:
+                log.record(etag, graph)
+            # Past roughly half the graph a snapshot is cheaper to apply.
+            return build_delta(log, since, graph, max_changes=max(len(graph['nodes']) // 2, 1))
+
+    def clear(self):
+        with self._lock:
+            self._logs.clear()
+
+
+def parse_version(version):
+    log_id, _, sequence = (version or '').partition('.')
+    try:
+        return log_id, int(sequence)
+    except ValueError:
+        return None, None
+
+
+def build_delta(log, since, graph, max_changes=None):
+    log_id, sequence = parse_version(since)
+    changes = log.changes_since(sequence) if log_id == log.log_id else None
+    if changes is not None and max_changes is not None and sum(map(len, changes)) > max_changes:
+        changes = None
+
+    if changes is None:
+        return {
+            'version': log.version,
+            'full': True,
+            'nodes': graph['nodes'],
+            'edges': graph['edges'],
+        }
+
+    added, removed, changed, edges_added, edges_removed = changes
+    return {
+        'version': log.version,
+        'full': False,
+        'nodes': {
+            'added': [node for node in graph['nodes'] if node['id'] in added],
+            'changed': [node for node in graph['nodes'] if node['id'] in changed],
+            'removed': sorted(removed),
+        },
+        'edges': {
+            'added': [edge for edge in graph['edges'] if edge_key(edge) in edges_added],
+            'removed': [
+                {'from': key[0], 'to': key[1], 'has_timer': key[2]}
+                for key in sorted(edges_removed)
+            ],
+        },
+    }
@@ -0,0 +1,100 @@
+import heapq
+import threading
+from datetime import timedelta
+
+from CTFd.models import db, Solves
+
+
+class ExpiryScheduler(object):
+    """Min-heap of (expires_at, team_id, challenge_id) for timed branches.
+
+    Entries are removed lazily: rescheduling only updates the per-team
+    deadline map, and stale heap items are skipped when popped.
+    """
+
+    def __init__(self):
+        self.graph_version = None
+        self._heap = []
+        self._deadlines = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def register_callback(self, callback):
+        if callback not in self._callbacks:
+            self._callbacks.append(callback)
+
+    def load(self, graph_version, entries):
+        deadlines = {}
+        for expires_at, team_id, challenge_id in entries:
+            deadlines.setdefault(team_id, {})[challenge_id] = expires_at
+        heap = [
+            (expires_at, team_id, challenge_id)
+            for team_id, challenges in deadlines.items()
+            for challenge_id, expires_at in challenges.items()
+        ]
+        heapq.heapify(heap)
+        with self._lock:
+            self.graph_version = graph_version
+            self._heap = heap
+            self._deadlines = deadlines
+
+    def schedule(self, team_id, challenge_id, expires_at):
+        with self._lock:
+            team_deadlines = self._deadlines.setdefault(team_id, {})
+            if team_deadlines.get(challenge_id) == expires_at:
+                return
+            team_deadlines[challenge_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, team_id, challenge_id))
+
+    def next_deadline(self, team_id):
+        with self._lock:
+            team_deadlines = self._deadlines.get(team_id)
+            return min(team_deadlines.values()) if team_deadlines else None
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def fire_due(self, now):
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] < now:
+                expires_at, team_id, challenge_id = heapq.heappop(self._heap)
+                team_deadlines = self._deadlines.get(team_id)
+                if not team_deadlines or team_deadlines.get(challenge_id) != expires_at:
+                    continue
+                del team_deadlines[challenge_id]
+                if not team_deadlines:
+                    del self._deadlines[team_id]
+                expired.append((team_id, challenge_id, expires_at))
+
+        for team_id, challenge_id, expires_at in expired:
+            for callback in self._callbacks:
+                callback(team_id, challenge_id, expires_at)
+        return expired
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(d) for d in self._deadlines.values())
+
+
+def load_expiry_entries(index, now):
+    timed = {}
+    for predecessor_id, challenge_id, max_lifetime in index.edges:
+        if max_lifetime:
+            timed.setdefault(predecessor_id, []).append((challenge_id, max_lifetime))
+    if not timed:
+        return []
+
+    solves = db.session.query(Solves.team_id, Solves.challenge_id, Solves.date).filter(
+        Solves.challenge_id.in_(list(timed)),
+        Solves.team_id.isnot(None),
+    )
+
+    entries = []
+    for team_id, predecessor_id, solve_date in solves:
+        for challenge_id, max_lifetime in timed[predecessor_id]:
+            expires_at = solve_date + timedelta(minutes=max_lifetime)
+            if expires_at >= now:
+                entries.append((expires_at, team_id, challenge_id))
+    return entries
@@ -0,0 +1,237 @@
+import threading
+from collections import namedtuple
+from uuid import uuid4
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from CTFd.cache import cache
+from CTFd.models import Challenges, db
+
+from .metrics import graph_metrics
+
+
+GRAPH_VERSION_KEY = 'storyline_graph_version'
+ATTRIBUTES_VERSION_KEY = 'storyline_attributes_version'
+ATTRIBUTE_COLUMNS = ('name', 'category', 'value')
+
+StorylineNode = namedtuple(
+    'StorylineNode', ['id', 'predecessor_id', 'max_lifetime', 'in_storyline'],
+)
+ChallengeAttributes = namedtuple('ChallengeAttributes', ATTRIBUTE_COLUMNS)
+ChallengeRow = namedtuple('ChallengeRow', ('id',) + ATTRIBUTE_COLUMNS)
+StorylineRow = namedtuple('StorylineRow', ['challenge_id', 'predecessor_id', 'max_lifetime'])
+
+
+def load_graph_rows():
+    """Load challenges and their storyline rows in a single round trip.
+
+    Challenges are outer-joined to their storyline row, so the result also
+    carries the attribute columns and a cold start can seed both snapshots
+    from it. Only plain rows come back: no polymorphic subclass loads and
+    nothing added to the session identity map.
+    """
+    from . import StorylineChallenge
+
+    rows = db.session.query(
+        Challenges.id, Challenges.name, Challenges.category, Challenges.value,
+        StorylineChallenge.id, StorylineChallenge.predecessor_id, StorylineChallenge.max_lifetime,
+    ).outerjoin(StorylineChallenge, StorylineChallenge.challenge_id == Challenges.id).all()
+
+    challenges = []
+    storyline = []
+    for challenge_id, name, category, value, storyline_id, predecessor_id, max_lifetime in rows:
+        challenges.append(ChallengeRow(challenge_id, name, category, value))
+        if storyline_id is not None:
+            storyline.append((storyline_id, StorylineRow(challenge_id, predecessor_id, max_lifetime)))
+    # Successor lists keep the storyline insertion order the old queries had.
+    storyline.sort(key=lambda item: item[0])
+    return challenges, [row for _, row in storyline]
+
+
+class StorylineGraphIndex(object):
+    """Immutable snapshot of the storyline DAG.
+
+    ``nodes`` keeps the order challenges were loaded in, ``successors`` is the
+    forward adjacency (predecessor -> children) and ``predecessors`` the
+    reverse one. A new snapshot is built whenever the shared graph version
+    changes, so readers never see a half-updated graph. Only the topology is
+    kept here; team state and expiry timers are keyed on its version, which
+    does not move when a challenge is renamed or its value decays.
+    """
+
+    def __init__(self, version, challenges, storyline_challenges):
+        self.version = version
+        self.storyline = {}
+        self.edges = []
+        self.successors = {}
+        self.predecessors = {}
+
+        for sc in storyline_challenges:
+            self.storyline[sc.challenge_id] = (sc.predecessor_id, sc.max_lifetime)
+            if sc.predecessor_id:
+                self.edges.append((sc.predecessor_id, sc.challenge_id, sc.max_lifetime))
+                self.successors.setdefault(sc.predecessor_id, []).append(sc.challenge_id)
+                self.predecessors[sc.challenge_id] = sc.predecessor_id
+
+        self.nodes = {}
+        for challenge in challenges:
+            predecessor_id, max_lifetime = self.storyline.get(challenge.id, (None, None))
+            self.nodes[challenge.id] = StorylineNode(
+                id=challenge.id,
+                predecessor_id=predecessor_id,
+                max_lifetime=max_lifetime,
+                in_storyline=challenge.id in self.storyline,
+            )
+
+
+class ChallengeAttributesSnapshot(object):
+    """Name, category and value of every challenge, applied to the graph
+    when it is serialized."""
+
+    def __init__(self, version, challenges):
+        self.version = version
+        self.attributes = {
+            challenge.id: ChallengeAttributes(challenge.name, challenge.category, challenge.value)
+            for challenge in challenges
+        }
+
+    def get(self, challenge_id):
+        return self.attributes.get(challenge_id)
+
+    @classmethod
+    def build(cls, version):
+        challenges = db.session.query(
+            Challenges.id, Challenges.name, Challenges.category, Challenges.value
+        ).all()
+        return cls(version, challenges)
+
+
+_index = None
+_index_lock = threading.Lock()
+_attributes = None
+_attributes_lock = threading.Lock()
+
+
+def get_shared_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        cache.set(key, version, timeout=0)
+    return version
+
+
+def get_graph_version():
+    return get_shared_version(GRAPH_VERSION_KEY)
+
+
+def get_attributes_version():
+    return get_shared_version(ATTRIBUTES_VERSION_KEY)
+
+
+def get_graph_index():
+    global _index
+    version = get_graph_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+
+    with _index_lock:
+        if _index is None or _index.version != version:
+            # Read before the rows are loaded: a concurrent edit then leaves
+            # the seeded attributes behind the shared version, never ahead.
+            attributes_version = get_attributes_version()
+            with graph_metrics.phase('index'):
+                challenges, storyline_challenges = load_graph_rows()
+                _index = StorylineGraphIndex(version, challenges, storyline_challenges)
+            graph_metrics.inc('storyline_graph_index_builds_total')
+            seed_challenge_attributes(attributes_version, challenges)
+        return _index
+
+
+def seed_challenge_attributes(version, challenges):
+    global _attributes
+    with _attributes_lock:
+        if _attributes is None or _attributes.version != version:
+            _attributes = ChallengeAttributesSnapshot(version, challenges)
+
+
+def get_challenge_attributes():
+    global _attributes
+    version = get_attributes_version()
+    attributes = _attributes
+    if attributes is not None and attributes.version == version:
+        return attributes
+
+    with _attributes_lock:
+        if _attributes is None or _attributes.version != version:
+            with graph_metrics.phase('attributes'):
+                _attributes = ChallengeAttributesSnapshot.build(version)
+            graph_metrics.inc('storyline_graph_attribute_builds_total')
+        return _attributes
+
+
+def invalidate_graph_index():
+    # The version lives in the shared cache so every worker drops its
+    # snapshot, not just the one that handled the write. A topology change
+    # (a new or deleted challenge) also stales the attributes.
+    global _index
+    cache.set(GRAPH_VERSION_KEY, uuid4().hex, timeout=0)
+    with _index_lock:
+        _index = None
+    invalidate_challenge_attributes()
+
+
+def invalidate_challenge_attributes():
+    global _attributes
+    cache.set(ATTRIBUTES_VERSION_KEY, uuid4().hex, timeout=0)
+    with _attributes_lock:
+        _attributes = None
+
+
+def mark_graph_dirty(session):
+    session.info['storyline_graph_dirty'] = True
+
+
+def _on_challenge_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        mark_graph_dirty(session)
+
+
+def _on_challenge_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in ATTRIBUTE_COLUMNS):
+        return
+    session = object_session(target)
+    if session is not None:
+        session.info['storyline_attributes_dirty'] = True
+
+
+def _on_after_commit(session):
+    graph_dirty = session.info.pop('storyline_graph_dirty', False)
+    attributes_dirty = session.info.pop('storyline_attributes_dirty', False)
+    if graph_dirty:
+        invalidate_graph_index()
+    elif attributes_dirty:
+        invalidate_challenge_attributes()
+
+
+def _on_after_rollback(session):
+    session.info.pop('storyline_graph_dirty', None)
+    session.info.pop('storyline_attributes_dirty', None)
+
+
+def register_graph_listeners():
+    # Challenge rows can change outside of the admin endpoints (dynamic
+    # challenges rewrite ``value`` on every solve), so watch the mapper and
+    # only publish a new version once the transaction is committed. Updates
+    # only ever touch the attributes, never the topology.
+    for name in ('after_insert', 'after_delete'):
+        if not event.contains(Challenges, name, _on_challenge_change):
+            event.listen(Challenges, name, _on_challenge_change, propagate=True)
+    if not event.contains(Challenges, 'after_update', _on_challenge_update):
+        event.listen(Challenges, 'after_update', _on_challenge_update, propagate=True)
+    if not event.contains(Session, 'after_commit', _on_after_commit):
+        event.listen(Session, 'after_commit', _on_after_commit)
+        event.listen(Session, 'after_rollback', _on_after_rollback)
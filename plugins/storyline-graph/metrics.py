@@ -0,0 +1,97 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+PHASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class GraphMetrics(object):
+    """Opt-in timings and counters for the storyline graph hot path.
+
+    Phase timings are only taken while ``enabled`` is set
+    (``STORYLINE_METRICS`` in the app config); counters are always kept
+    since they cost a single increment.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._phases.get(name)
+            if histogram is None:
+                histogram = self._phases[name] = [[0] * len(PHASE_BUCKETS), 0, 0.0]
+            buckets = histogram[0]
+            for i, bound in enumerate(PHASE_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._phases.clear()
+            self._counters.clear()
+
+    def render(self, counters=(), gauges=()):
+        lines = [
+            '# HELP storyline_graph_phase_seconds Time spent in each phase of building the storyline graph.',
+            '# TYPE storyline_graph_phase_seconds histogram',
+        ]
+        with self._lock:
+            phases = {name: (list(h[0]), h[1], h[2]) for name, h in self._phases.items()}
+            all_counters = dict(self._counters)
+        for name, labels, value in counters:
+            all_counters[(name, tuple(sorted(labels.items())))] = value
+
+        for name in sorted(phases):
+            buckets, count, total = phases[name]
+            for bound, value in zip(PHASE_BUCKETS, buckets):
+                lines.append('storyline_graph_phase_seconds_bucket{phase="%s",le="%s"} %d' % (name, bound, value))
+            lines.append('storyline_graph_phase_seconds_bucket{phase="%s",le="+Inf"} %d' % (name, count))
+            lines.append('storyline_graph_phase_seconds_sum{phase="%s"} %.6f' % (name, total))
+            lines.append('storyline_graph_phase_seconds_count{phase="%s"} %d' % (name, count))
+
+        seen = set()
+        for (name, labels), value in sorted(all_counters.items()):
+            if name not in seen:
+                lines.append('# TYPE %s counter' % name)
+                seen.add(name)
+            lines.append('%s%s %d' % (name, format_labels(labels), value))
+
+        for name, labels, value in gauges:
+            if name not in seen:
+                lines.append('# TYPE %s gauge' % name)
+                seen.add(name)
+            lines.append('%s%s %d' % (name, format_labels(tuple(sorted(labels.items()))), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, value) for key, value in labels)
+
+
+graph_metrics = GraphMetrics()
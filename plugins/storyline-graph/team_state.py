@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+
+
+DEFAULT_TEAM_CACHE_SIZE = 4096
+
+SolveDelta = namedtuple('SolveDelta', ['team_id', 'challenge_id', 'unlocked', 'timers_started'])
+
+
+class TeamState(object):
+    __slots__ = ('graph_version', 'marker', 'solved', 'unlocked', 'visible', 'deadlines', 'expires_at')
+
+    def __init__(self, graph_version, marker, solved, unlocked, visible, deadlines):
+        self.graph_version = graph_version
+        self.marker = marker
+        self.solved = solved
+        self.unlocked = unlocked
+        self.visible = visible
+        self.deadlines = deadlines
+        self.expires_at = min(deadlines.values()) if deadlines else None
+
+    def is_fresh(self, graph_version, marker, now):
+        if self.graph_version != graph_version or self.marker != marker:
+            return False
+        return self.expires_at is None or now <= self.expires_at
+
+
+def compute_unlocked(index, solved, now):
+    unlocked = set()
+    deadlines = {}
+
+    for node in index.nodes.values():
+        if not node.in_storyline or not node.predecessor_id:
+            unlocked.add(node.id)
+        elif node.predecessor_id in solved:
+            if node.max_lifetime:
+                expires_at = solved[node.predecessor_id] + timedelta(minutes=node.max_lifetime)
+                if now <= expires_at:
+                    unlocked.add(node.id)
+                    deadlines[node.id] = expires_at
+            else:
+                unlocked.add(node.id)
+
+    return unlocked, deadlines
+
+
+def compute_visible(index, solved, unlocked):
+    visible = set(solved)
+    for challenge_id in unlocked:
+        node = index.nodes.get(challenge_id)
+        if node is not None and node.in_storyline:
+            if (node.predecessor_id is None or
+                node.predecessor_id in solved or
+                node.predecessor_id in unlocked):
+                visible.add(challenge_id)
+        else:
+            visible.add(challenge_id)
+    return visible
+
+
+def apply_solve(index, state, team_id, challenge_id, solve_date, marker, now):
+    # Only the direct successors of the solved challenge can change state,
+    # so the new snapshot is derived from the cached one instead of walking
+    # the whole graph again.
+    solved = dict(state.solved)
+    unlocked = set(state.unlocked)
+    visible = set(state.visible)
+    deadlines = dict(state.deadlines)
+
+    solved[challenge_id] = solve_date
+    visible.add(challenge_id)
+
+    newly_unlocked = []
+    timers_started = {}
+    for successor_id in index.successors.get(challenge_id, ()):
+        node = index.nodes.get(successor_id)
+        if node is None or successor_id in unlocked:
+            continue
+        if node.max_lifetime:
+            expires_at = solve_date + timedelta(minutes=node.max_lifetime)
+            if now > expires_at:
+                continue
+            deadlines[successor_id] = expires_at
+            timers_started[successor_id] = expires_at
+        unlocked.add(successor_id)
+        visible.add(successor_id)
+        newly_unlocked.append(successor_id)
+
+    new_state = TeamState(index.version, marker, solved, unlocked, visible, deadlines)
+    return new_state, SolveDelta(team_id, challenge_id, newly_unlocked, timers_started)
+
+
+class TeamStateCache(object):
+    """LRU of per-team unlock state.
+
+    An entry stays valid until the graph version or the team's solve marker
+    changes, or until the earliest open timer in it runs out.
+    """
+
+    def __init__(self, maxsize=DEFAULT_TEAM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, team_id, graph_version, marker, now):
+        with self._lock:
+            state = self._entries.get(team_id)
+            if state is None or not state.is_fresh(graph_version, marker, now):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(team_id)
+            self.hits += 1
+            return state
+
+    def peek(self, team_id):
+        with self._lock:
+            return self._entries.get(team_id)
+
+    def put(self, team_id, state):
+        with self._lock:
+            self._entries[team_id] = state
+            self._entries.move_to_end(team_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, team_id):
+        with self._lock:
+            self._entries.pop(team_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
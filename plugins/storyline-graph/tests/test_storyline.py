@@ -0,0 +1,167 @@
+import importlib
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from CTFd import create_app
+from CTFd.config import TestingConfig
+from CTFd.models import Challenges, Solves, Teams, Users, db
+from CTFd.plugins.dynamic_challenges import DynamicChallenge, DynamicValueChallenge
+
+storyline = importlib.import_module('CTFd.plugins.storyline-graph')
+graph_index = importlib.import_module('CTFd.plugins.storyline-graph.graph_index')
+team_state = importlib.import_module('CTFd.plugins.storyline-graph.team_state')
+
+ChallengeRow = namedtuple('ChallengeRow', ['id'])
+StorylineRow = namedtuple('StorylineRow', ['challenge_id', 'predecessor_id', 'max_lifetime'])
+
+
+def random_index(rng, size):
+    challenges = [ChallengeRow(i) for i in range(1, size + 1)]
+    storyline_challenges = []
+    for i in range(2, size + 1):
+        if rng.random() < 0.7:
+            storyline_challenges.append(StorylineRow(
+                i,
+                rng.randint(1, i - 1) if rng.random() < 0.8 else None,
+                rng.choice([None, 5, 10, 30]),
+            ))
+    return graph_index.StorylineGraphIndex('v', challenges, storyline_challenges)
+
+
+def test_apply_solve_matches_full_recompute():
+    rng = random.Random(0)
+    now = datetime(2025, 1, 1, 12, 0)
+    for _ in range(500):
+        index = random_index(rng, rng.randint(1, 12))
+        unlocked, deadlines = team_state.compute_unlocked(index, {}, now)
+        visible = team_state.compute_visible(index, {}, unlocked)
+        state = team_state.TeamState(index.version, (0, None), {}, unlocked, visible, deadlines)
+
+        solved = {}
+        order = list(index.nodes)
+        rng.shuffle(order)
+        for challenge_id in order[:rng.randint(0, len(order))]:
+            solve_date = now - timedelta(minutes=rng.randint(0, 40))
+            solved[challenge_id] = solve_date
+            state, delta = team_state.apply_solve(
+                index, state, 1, challenge_id, solve_date, (len(solved), None), now
+            )
+
+            unlocked, deadlines = team_state.compute_unlocked(index, solved, now)
+            assert state.solved == solved
+            assert state.unlocked == unlocked
+            assert state.deadlines == deadlines
+            assert state.visible == team_state.compute_visible(index, solved, unlocked)
+            assert set(delta.timers_started) <= set(deadlines)
+
+
+def test_attribute_changes_keep_the_topology_version():
+    app = create_app(TestingConfig)
+
+    with app.app_context():
+        first = Challenges(name='first', category='story', value=500)
+        second = Challenges(name='second', category='story', value=100)
+        team = Teams(name='team', email='team@examplectf.com')
+        db.session.add_all([first, second, team])
+        db.session.flush()
+        db.session.add(storyline.StorylineChallenge(challenge_id=second.id, predecessor_id=first.id))
+        db.session.commit()
+
+        index = graph_index.get_graph_index()
+        attributes = graph_index.get_challenge_attributes()
+        state = storyline.get_team_state(team.id)
+
+        first.value = 450
+        db.session.commit()
+        assert graph_index.get_graph_index() is index
+        assert storyline.get_team_state(team.id) is state
+        assert graph_index.get_challenge_attributes() is not attributes
+        nodes = {node['id']: node for node in storyline.get_graph_data()['nodes']}
+        assert nodes[first.id]['value'] == 450
+
+        attributes = graph_index.get_challenge_attributes()
+        first.description = 'unused by the graph'
+        db.session.commit()
+        assert graph_index.get_challenge_attributes() is attributes
+
+        first.value = 400
+        db.session.rollback()
+        assert graph_index.get_challenge_attributes() is attributes
+
+        db.session.add(Challenges(name='third', category='story', value=100))
+        db.session.commit()
+        assert graph_index.get_graph_index() is not index
+        assert len(graph_index.get_graph_index().nodes) == 3
+
+
+def test_dynamic_solves_advance_team_state_incrementally(monkeypatch):
+    app = create_app(TestingConfig)
+
+    with app.app_context():
+        first = DynamicChallenge(
+            name='first', category='story', initial=500, minimum=100, decay=10, function='linear',
+        )
+        second = Challenges(name='second', category='story', value=100)
+        db.session.add_all([first, second])
+        db.session.flush()
+        db.session.add(storyline.StorylineChallenge(challenge_id=second.id, predecessor_id=first.id))
+        accounts = []
+        for i in range(2):
+            team = Teams(name='team%d' % i, email='team%d@examplectf.com' % i)
+            db.session.add(team)
+            db.session.flush()
+            user = Users(name='user%d' % i, email='user%d@examplectf.com' % i, team_id=team.id)
+            db.session.add(user)
+            accounts.append((user, team))
+        db.session.commit()
+        for user, team in accounts:
+            assert second.id not in storyline.get_team_state(team.id).unlocked
+
+        rebuilds = []
+        get_team_state = storyline.get_team_state
+        monkeypatch.setattr(
+            storyline, 'get_team_state', lambda team_id: rebuilds.append(team_id) or get_team_state(team_id)
+        )
+        index = graph_index.get_graph_index()
+        for user, team in accounts:
+            with app.test_request_context(method='POST', json={'submission': 'flag'}) as ctx:
+                DynamicValueChallenge.solve(user, team, first, ctx.request)
+
+        # The second solve lowered the value, which must not stale the graph.
+        assert first.value == 490
+        assert graph_index.get_graph_index() is index
+        assert rebuilds == []
+        for user, team in accounts:
+            assert second.id in storyline.team_state_cache.peek(team.id).unlocked
+
+
+def test_etag_changes_when_a_branch_expires_on_another_worker(monkeypatch):
+    app = create_app(TestingConfig)
+    now = datetime.utcnow()
+
+    with app.app_context():
+        first = Challenges(name='first', category='story', value=100)
+        second = Challenges(name='second', category='story', value=100)
+        team = Teams(name='team', email='team@examplectf.com')
+        db.session.add_all([first, second, team])
+        db.session.flush()
+        user = Users(name='user', email='user@examplectf.com', team_id=team.id)
+        db.session.add(user)
+        db.session.add(storyline.StorylineChallenge(challenge_id=second.id, predecessor_id=first.id, max_lifetime=1))
+        db.session.commit()
+        storyline.get_graph_etag(team.id)
+
+        # Solved through another worker, so this one never scheduled the timer.
+        db.session.add(Solves(user_id=user.id, team_id=team.id, challenge_id=first.id, date=now))
+        db.session.commit()
+        etag = storyline.get_graph_etag(team.id)
+
+        class later(datetime):
+            @classmethod
+            def utcnow(cls):
+                return now + timedelta(minutes=2)
+
+        monkeypatch.setattr(storyline, 'datetime', later)
+        assert storyline.get_graph_etag(team.id) != etag
+        assert second.id not in storyline.get_team_state(team.id).unlocked